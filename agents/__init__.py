@@ -1,2 +1,7 @@
 from .planner_agent import generate_plan
 from .repair_agent import repair_step
+from .subgoal_agent import decompose_task, plan_subgoal
+from .history import RollingHistory
+from .usage import UsageTracker, BudgetExceededError
+from .call_llm import LLMCallError
+from .router import Router, routing_enabled, app_seen_before
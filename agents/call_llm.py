@@ -9,53 +9,74 @@ if __name__ == "__main__":
         result = call_gpt5_1(prompt, api_key)
         print("Result:", result)
 
+import time
+
 from openai import OpenAI
 
-def call_gpt4_1(prompt, api_key):
+from agents.usage import BudgetExceededError
+
+
+class LLMCallError(Exception):
+    """Raised when the API request itself fails, so the error text is never parsed as model output."""
+
+    def __init__(self, model, error):
+        super().__init__(f"LLM_CALL_FAILED: {model}: {error}")
+        self.model = model
+        self.error = error
+
+
+def _call_model(model, prompt, api_key, tracker=None, agent=None, step=None, client=None):
     """
-    Calls the OpenAI GPT-4.1 Responses API with the given prompt.
-    Returns: str: The response from the GPT-4.1 model.
+    Calls the OpenAI Responses API for `model` and returns output_text.
+    When a UsageTracker is given, the call reserves run budget first (raising
+    BudgetExceededError) and its token usage is recorded. A failed request
+    raises LLMCallError.
+    A caller-owned `client` can be passed so the request can be aborted by closing it.
     """
-    client = OpenAI(api_key=api_key)
+    reservation = None
+    max_output_tokens = None
+    if tracker is not None:
+        reservation = tracker.check_budget(model, prompt, agent=agent, step=step)
+        max_output_tokens = reservation["max_output_tokens"]
+
+    client = client or OpenAI(api_key=api_key)
     try:
-        response = client.responses.create(
-            model="gpt-4.1",
-            input=prompt
-        )
+        kwargs = {"model": model, "input": prompt}
+        if max_output_tokens is not None:
+            kwargs["max_output_tokens"] = max_output_tokens
+        started = time.perf_counter()
+        response = client.responses.create(**kwargs)
+        if tracker is not None:
+            tracker.record(model, response.usage, agent=agent, step=step,
+                           latency=time.perf_counter() - started, reservation=reservation)
         return response.output_text
+    except BudgetExceededError:
+        raise
     except Exception as e:
-        return f"An error occurred: {e}"
+        if tracker is not None:
+            tracker.release(reservation)
+        raise LLMCallError(model, e) from e
 
-def call_o3_mini(prompt, api_key):
+def call_gpt4_1(prompt, api_key, tracker=None, agent=None, step=None):
+    """
+    Calls the OpenAI GPT-4.1 Responses API with the given prompt.
+    Returns: str: The response from the GPT-4.1 model.
+    """
+    return _call_model("gpt-4.1", prompt, api_key, tracker=tracker, agent=agent, step=step)
+
+def call_o3_mini(prompt, api_key, tracker=None, agent=None, step=None):
     """
     Calls the OpenAI o3-mini Responses API with the given prompt.
     Returns: str: The response from the o3-mini model.
     """
-    client = OpenAI(api_key=api_key)
-    try:
-        response = client.responses.create(
-            model="o3-mini",
-            input=prompt
-        )
-        return response.output_text
-    except Exception as e:
-        return f"An error occurred: {e}"
+    return _call_model("o3-mini", prompt, api_key, tracker=tracker, agent=agent, step=step)
 
-def call_gpt5_1(prompt, api_key):
+def call_gpt5_1(prompt, api_key, tracker=None, agent=None, step=None):
     """
     Calls the OpenAI GPT-5.1 Responses API with the given prompt.
     Returns: str: The response from the GPT-5.1 model.
     """
-    client = OpenAI(api_key=api_key)
-    try:
-        response = client.responses.create(
-            model="gpt-5.1",
-            input=prompt
-        )
-        return response.output_text
-    except Exception as e:
-        return f"An error occurred: {e}"
-
+    return _call_model("gpt-5.1", prompt, api_key, tracker=tracker, agent=agent, step=step)
 
 if __name__ == "__main__":
     import os
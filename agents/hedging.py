@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from openai import OpenAI
+
+from agents.call_llm import _call_model, LLMCallError
+from agents.model_stats import get_model_stats
+from agents.usage import BudgetExceededError
+
+
+def hedging_enabled():
+    return os.getenv("LLM_HEDGE", "0") == "1"
+
+
+def hedge_config():
+    """Hedging settings from the environment (see README)."""
+    return {
+        "secondary": os.getenv("LLM_HEDGE_MODEL", "gpt-4.1"),
+        "percentile": float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+        "default_delay": float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "20")),
+    }
+
+
+def hedged_call(prompt, api_key, validator, primary="o3-mini", secondary="gpt-4.1",
+                percentile=95, default_delay=20.0, stats=None,
+                tracker=None, agent=None, step=None):
+    """
+    Sends `prompt` to `primary`; if it has not answered within its `percentile`
+    latency (or answers with something `validator` rejects), sends the same
+    prompt to `secondary`. The first response that passes `validator` wins and
+    the other in-flight request is cancelled by closing its HTTP client.
+
+    With a budget, the backup is only reserved when it launches, from what the
+    primary's reservation leaves; if that is too little, no hedge is sent. An
+    aborted leg is recorded as an estimated usage entry.
+
+    Returns (response_text, model). If neither response is valid, the primary's
+    response is returned (or the secondary's if the primary produced none) so the
+    caller reports the parse error exactly as before. If neither leg produced a
+    response, the primary's LLMCallError is raised.
+    """
+    stats = stats or get_model_stats()
+    delay = stats.hedge_delay(primary, pct=percentile, default=default_delay)
+
+    clients = {}
+    errors = {}
+    cancelled = set()
+    lock = threading.Lock()
+
+    def run(model):
+        client = OpenAI(api_key=api_key)
+        with lock:
+            if model in cancelled:
+                return model, None, False
+            clients[model] = client
+        started = time.perf_counter()
+        try:
+            text = _call_model(model, prompt, api_key, tracker=tracker, agent=agent, step=step,
+                               client=client)
+        except BudgetExceededError as e:
+            if model == primary:
+                raise
+            print(f"[HEDGE] not hedging with {secondary}: {e}")
+            return model, None, False
+        except LLMCallError as e:
+            text = None
+            errors[model] = e
+        latency = time.perf_counter() - started
+        with lock:
+            was_cancelled = model in cancelled
+        if was_cancelled:
+            # The primary was hedged for being slow, so its elapsed time is a
+            # lower bound on its latency; the backup's says nothing about it
+            stats.record_cancelled(model, elapsed=latency if model == primary else None)
+            if tracker is not None and text is None:
+                tracker.record_aborted(model, prompt, agent=agent, step=step, latency=latency)
+            return model, text, False
+        if text is None:
+            print(f"[HEDGE] {errors[model]}")
+            return model, None, False
+        valid = validator(text)
+        stats.record(model, latency, valid)
+        return model, text, valid
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    pending = {pool.submit(run, primary)}
+    launched = {primary}
+    results = {}
+
+    try:
+        done, pending = wait(pending, timeout=delay)
+        if not done:
+            print(f"[HEDGE] {primary} slower than p{percentile:g} ({delay:.1f}s), also asking {secondary}")
+            pending.add(pool.submit(run, secondary))
+            launched.add(secondary)
+
+        while True:
+            for future in done:
+                model, text, valid = future.result()
+                results[model] = text
+                if valid:
+                    if pending:
+                        print(f"[HEDGE] {model} answered first, cancelling the other request")
+                    return text, model
+                if secondary not in launched:
+                    # Primary answered but unusably: hedge immediately instead of waiting
+                    print(f"[HEDGE] {primary} returned invalid output, asking {secondary}")
+                    pending.add(pool.submit(run, secondary))
+                    launched.add(secondary)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        if results.get(primary) is not None:
+            return results[primary], primary
+        if results.get(secondary) is not None:
+            return results[secondary], secondary
+        raise errors.get(primary) or errors[secondary]
+    finally:
+        with lock:
+            losers = [m for m in launched if m not in results]
+            cancelled.update(losers)
+            for model in losers:
+                client = clients.get(model)
+                if client is not None:
+                    client.close()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,100 @@
+from collections import deque
+
+
+class RollingHistory:
+    """
+    Bounded summary of what a long run has done so far, used in place of the
+    full previous_steps list in hierarchical planning and repair prompts.
+
+    Keeps the last `max_recent` steps verbatim (as one-line summaries), the last
+    `max_subgoals` completed subgoals, and running counters. Its size, and so
+    the prompt size, stays constant however long the workflow gets.
+    """
+
+    def __init__(self, max_recent=8, max_subgoals=10, max_chars=3000):
+        self.max_recent = max_recent
+        self.max_subgoals = max_subgoals
+        self.max_chars = max_chars
+
+        self.recent = deque(maxlen=max_recent)
+        self.completed_subgoals = deque(maxlen=max_subgoals)
+        self.subgoals_done = 0
+        self.total_steps = 0
+        self.repaired_steps = 0
+        self.action_counts = {}
+        self.last_url = None
+
+    def add_step(self, step, repaired=False, url=None):
+        action = step.get("action", "?")
+        self.total_steps += 1
+        self.repaired_steps += int(repaired)
+        self.action_counts[action] = self.action_counts.get(action, 0) + 1
+        if url:
+            self.last_url = url
+        self.recent.append(_summarize_step(step, repaired))
+
+    def complete_subgoal(self, goal):
+        self.subgoals_done += 1
+        self.completed_subgoals.append(goal)
+
+    def render(self):
+        lines = [
+            f"Steps executed so far: {self.total_steps} "
+            f"({self.repaired_steps} repaired); subgoals completed: {self.subgoals_done}",
+        ]
+        if self.action_counts:
+            counts = ", ".join(f"{a}={n}" for a, n in sorted(self.action_counts.items()))
+            lines.append(f"Actions: {counts}")
+        if self.last_url:
+            lines.append(f"Last URL: {self.last_url}")
+        if self.completed_subgoals:
+            skipped = self.subgoals_done - len(self.completed_subgoals)
+            lines.append("Completed subgoals" + (f" (last {len(self.completed_subgoals)}):" if skipped else ":"))
+            lines.extend(f"  - {goal}" for goal in self.completed_subgoals)
+        if self.recent:
+            lines.append(f"Most recent steps (last {len(self.recent)}):")
+            lines.extend(f"  - {summary}" for summary in self.recent)
+
+        text = "\n".join(lines)
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars] + "\n  ... (truncated)"
+        return text
+
+    def to_dict(self):
+        return {
+            "max_recent": self.max_recent,
+            "max_subgoals": self.max_subgoals,
+            "max_chars": self.max_chars,
+            "recent": list(self.recent),
+            "completed_subgoals": list(self.completed_subgoals),
+            "subgoals_done": self.subgoals_done,
+            "total_steps": self.total_steps,
+            "repaired_steps": self.repaired_steps,
+            "action_counts": self.action_counts,
+            "last_url": self.last_url,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        history = cls(data["max_recent"], data["max_subgoals"], data["max_chars"])
+        history.recent.extend(data["recent"])
+        history.completed_subgoals.extend(data["completed_subgoals"])
+        history.subgoals_done = data["subgoals_done"]
+        history.total_steps = data["total_steps"]
+        history.repaired_steps = data["repaired_steps"]
+        history.action_counts = data["action_counts"]
+        history.last_url = data["last_url"]
+        return history
+
+
+def _summarize_step(step, repaired):
+    parts = [step.get("action", "?")]
+    if step.get("selector"):
+        parts.append(str(step["selector"])[:120])
+    if step.get("value") not in (None, ""):
+        parts.append(f"value={str(step['value'])[:80]!r}")
+    if step.get("description"):
+        parts.append(f"({str(step['description'])[:80]})")
+    if repaired:
+        parts.append("[repaired]")
+    return " ".join(parts)
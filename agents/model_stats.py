@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import threading
+from collections import deque
+from pathlib import Path
+
+
+DEFAULT_STATS_PATH = "agent_outputs/model_stats.json"
+
+
+class ModelStats:
+    """
+    Rolling per-model latency and validity statistics, persisted across runs.
+
+    For every model it keeps the last `window` latencies of completed calls,
+    the elapsed times of calls cancelled after being hedged (lower bounds on
+    their latency, see record_cancelled), counters for valid / invalid
+    responses and calls cancelled because another model answered first, and
+    per agent kind the last `outcome_window` outcomes of routed calls (see
+    record_outcome). Used to tune the hedge delay and by the model router.
+    """
+
+    def __init__(self, path=DEFAULT_STATS_PATH, window=200, outcome_window=50):
+        self.path = Path(path) if path else None
+        self.window = window
+        self.outcome_window = outcome_window
+        self.models = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, model):
+        entry = self.models.get(model)
+        if entry is None:
+            entry = {
+                "latencies": deque(maxlen=self.window),
+                "censored": deque(maxlen=self.window),
+                "valid": 0,
+                "invalid": 0,
+                "cancelled": 0,
+                # agent kind -> recent routed outcomes (True = succeeded)
+                "outcomes": {},
+            }
+            self.models[model] = entry
+        return entry
+
+    # ---------------------------------------------
+    # RECORDING
+    # ---------------------------------------------
+    def record(self, model, latency, valid):
+        with self._lock:
+            entry = self._entry(model)
+            entry["latencies"].append(latency)
+            entry["valid" if valid else "invalid"] += 1
+            self._save()
+
+    def record_cancelled(self, model, elapsed=None):
+        """
+        Counts a call cancelled because another model answered first. Pass
+        `elapsed` for a call that was hedged for being slow: its true latency is
+        at least that long, and leaving it out would bias the percentiles (and
+        so the hedge delay) downwards after every hedge.
+        """
+        with self._lock:
+            entry = self._entry(model)
+            entry["cancelled"] += 1
+            if elapsed is not None:
+                entry["censored"].append(elapsed)
+            self._save()
+
+    def record_outcome(self, model, agent, success):
+        """
+        Records the outcome of a call the router sent to `model` for `agent`
+        (planner, repair, ...): an invalid response, or whether the response
+        was usable (for repairs: whether the repaired step executed).
+        """
+        with self._lock:
+            outcomes = self._entry(model)["outcomes"]
+            if agent not in outcomes:
+                outcomes[agent] = deque(maxlen=self.outcome_window)
+            outcomes[agent].append(bool(success))
+            self._save()
+
+    # ---------------------------------------------
+    # QUERIES
+    # ---------------------------------------------
+    def percentile(self, model, pct):
+        """
+        Nearest-rank percentile of recent latencies (seconds), or None without
+        samples. Cancelled calls count at their elapsed time (a lower bound).
+        """
+        entry = self.models.get(model)
+        if not entry or not (entry["latencies"] or entry["censored"]):
+            return None
+        ordered = sorted([*entry["latencies"], *entry["censored"]])
+        rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+        return ordered[rank]
+
+    def samples(self, model):
+        entry = self.models.get(model)
+        return len(entry["latencies"]) + len(entry["censored"]) if entry else 0
+
+    def validity_rate(self, model):
+        entry = self.models.get(model)
+        if not entry or entry["valid"] + entry["invalid"] == 0:
+            return None
+        return entry["valid"] / (entry["valid"] + entry["invalid"])
+
+    def success_rate(self, model, agent, min_samples=5):
+        """
+        Share of successful outcomes among the recent routed calls to `model`
+        for `agent`, or None until `min_samples` outcomes are known.
+        """
+        entry = self.models.get(model)
+        outcomes = entry["outcomes"].get(agent) if entry else None
+        if not outcomes or len(outcomes) < min_samples:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    def hedge_delay(self, model, pct=95, default=20.0, min_samples=5):
+        """
+        Seconds to wait for `model` before hedging: its `pct` latency percentile
+        once it has `min_samples` completed calls, `default` until then.
+        """
+        if self.samples(model) < min_samples:
+            return default
+        return self.percentile(model, pct)
+
+    # ---------------------------------------------
+    # PERSISTENCE
+    # ---------------------------------------------
+    @classmethod
+    def load(cls, path=DEFAULT_STATS_PATH, window=200, outcome_window=50):
+        stats = cls(path=path, window=window, outcome_window=outcome_window)
+        if stats.path is not None and stats.path.exists():
+            with open(stats.path) as f:
+                data = json.load(f)
+            for model, saved in data.get("models", {}).items():
+                entry = stats._entry(model)
+                entry["latencies"].extend(saved.get("latencies", []))
+                entry["censored"].extend(saved.get("censored", []))
+                for key in ("valid", "invalid", "cancelled"):
+                    entry[key] = saved.get(key, 0)
+                for agent, outcomes in saved.get("outcomes", {}).items():
+                    entry["outcomes"][agent] = deque(outcomes, maxlen=stats.outcome_window)
+        return stats
+
+    def to_dict(self):
+        return {
+            "models": {
+                model: {
+                    **{k: v for k, v in entry.items() if k not in ("latencies", "censored", "outcomes")},
+                    "latencies": [round(x, 3) for x in entry["latencies"]],
+                    "censored": [round(x, 3) for x in entry["censored"]],
+                    "outcomes": {agent: list(o) for agent, o in entry["outcomes"].items()},
+                    "p50": self.percentile(model, 50),
+                    "p95": self.percentile(model, 95),
+                }
+                for model, entry in self.models.items()
+            }
+        }
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with open(self.path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+_default_stats = None
+
+
+def get_model_stats():
+    """Process-wide ModelStats loaded from MODEL_STATS_PATH (default agent_outputs/model_stats.json)."""
+    global _default_stats
+    if _default_stats is None:
+        _default_stats = ModelStats.load(os.getenv("MODEL_STATS_PATH", DEFAULT_STATS_PATH))
+    return _default_stats
@@ -72,12 +72,25 @@ Now generate the JSON array of steps for the following task:
 
 # --- LLM Call Function ---
 from agents.call_llm import call_o3_mini
+from agents.hedging import hedging_enabled, hedge_config, hedged_call
+from agents.validation import is_valid_plan_response
+from agents.router import classify_request
 
 # --- Plan Generation Function ---
-def generate_plan(task_description, api_key):
+def generate_plan(task_description, api_key, tracker=None, router=None, app_seen=True):
     """
     Generates a plan using o3-mini for the given task description.
+    Token usage is recorded on `tracker` (a UsageTracker) when given.
+    With a `router` the model tier is picked by difficulty (new apps are harder).
+    With LLM_HEDGE=1 a slow or invalid o3-mini answer is hedged with a second model.
     """
     prompt = prompt_A.format(TASK_DESCRIPTION=task_description)
-    response = call_o3_mini(prompt, api_key)
+    if router is not None:
+        features = classify_request("planner", prompt, app_seen=app_seen)
+        return router.call(prompt, api_key, is_valid_plan_response, features, tracker=tracker)
+    if hedging_enabled():
+        response, _ = hedged_call(prompt, api_key, is_valid_plan_response, primary="o3-mini",
+                                  tracker=tracker, agent="planner", **hedge_config())
+        return response
+    response = call_o3_mini(prompt, api_key, tracker=tracker, agent="planner")
     return response
@@ -17,16 +17,18 @@ Context Provided:
 4. error_message:
     {ERROR_MESSAGE}
 
-5. semantic_dom:
+5. semantic_dom (one element per line: [index] tag role "text" attributes selector=...):
     {SEMANTIC_DOM}   
 
-6. accessibility_tree:
+6. accessibility_tree (indented by depth: role "name" properties):
     {ACCESSIBILITY_TREE}
 
 Your responsibilities:
 - Diagnose why the failed step did not work.
 - Repair ONLY the failed step.
 - Use the semantic_dom and accessibility_tree to locate a more reliable selector.
+- Every semantic_dom selector= matches exactly one element on the current page; copy it verbatim,
+  preferring elements with a higher stability.
 - Use only the allowed actions:
   ["goto", "click", "wait_for", "type", "press", "hover", "screenshot",
     "set_title", "keyboard_type", "keyboard_press", "scroll_to", "scroll_by",
@@ -58,10 +60,17 @@ Do not return an array. Do not return previous steps. Return only the fixed step
 
 
 from agents.call_llm import call_o3_mini
+from agents.hedging import hedging_enabled, hedge_config, hedged_call
+from agents.validation import is_valid_step_response
+from agents.router import classify_request
 
-def repair_step(task_description, previous_steps, failed_step, error_message, semantic_dom, accessibility_tree, api_key):
+def repair_step(task_description, previous_steps, failed_step, error_message, semantic_dom, accessibility_tree, api_key,
+                tracker=None, step_index=None, router=None, min_tier=0):
      """
      Repairs a failed step using o3-mini and returns the repaired step.
+     Token usage is recorded on `tracker` against `step_index` when given.
+     With a `router` the model tier is picked from the failure type, starting at `min_tier`.
+     With LLM_HEDGE=1 a slow or invalid o3-mini answer is hedged with a second model.
      """
      prompt = prompt_B.replace("{TASK_DESCRIPTION}", task_description)
      prompt = prompt.replace("{PREVIOUS_STEPS}", previous_steps)
@@ -69,5 +78,13 @@ def repair_step(task_description, previous_steps, failed_step, error_message, se
      prompt = prompt.replace("{ERROR_MESSAGE}", error_message)
      prompt = prompt.replace("{SEMANTIC_DOM}", semantic_dom)
      prompt = prompt.replace("{ACCESSIBILITY_TREE}", accessibility_tree)
-     response = call_o3_mini(prompt, api_key)
+     if router is not None:
+          features = classify_request("repair", prompt, error_message=error_message)
+          return router.call(prompt, api_key, is_valid_step_response, features,
+                             tracker=tracker, step=step_index, min_tier=min_tier)
+     if hedging_enabled():
+          response, _ = hedged_call(prompt, api_key, is_valid_step_response, primary="o3-mini",
+                                    tracker=tracker, agent="repair", step=step_index, **hedge_config())
+          return response
+     response = call_o3_mini(prompt, api_key, tracker=tracker, agent="repair", step=step_index)
      return response
@@ -0,0 +1,204 @@
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+from agents.call_llm import _call_model
+from agents.hedging import hedging_enabled, hedge_config, hedged_call
+from agents.model_stats import get_model_stats
+from agents.usage import estimate_tokens
+
+
+# Weakest / fastest first (gpt-4.1 answers without a reasoning pass, though
+# o3-mini is cheaper per token). Escalation always moves one tier to the right.
+MODEL_TIERS = ["gpt-4.1", "o3-mini", "gpt-5.1"]
+
+DIFFICULTY_TIER = {"easy": 0, "medium": 1, "hard": 2}
+DIFFICULTY_NAMES = ["easy", "medium", "hard"]
+
+# Prompts above this many (estimated) tokens are bumped one difficulty level
+LARGE_PROMPT_TOKENS = 30000
+
+# Error message patterns -> failure type
+FAILURE_PATTERNS = [
+    ("selector", re.compile(r"CLICK_FAILED|strict mode violation|waiting for (locator|selector)|"
+                            r"No node found|not an? (input|select|<input>)|Unknown engine|"
+                            r"is not a valid selector|resolved to \d+ elements", re.I)),
+    ("timeout", re.compile(r"Timeout \d+ms exceeded|TimeoutError", re.I)),
+    ("no_effect", re.compile(r"DOM_NOT_CHANGED", re.I)),
+    ("navigation", re.compile(r"net::ERR|Navigation|frame was detached|Target closed", re.I)),
+    ("invalid_step", re.compile(r"Unknown action|NoneType|KeyError", re.I)),
+]
+
+# Base difficulty of a repair by failure type
+FAILURE_DIFFICULTY = {
+    "selector": "easy",
+    "timeout": "easy",
+    "no_effect": "medium",
+    "navigation": "medium",
+    "invalid_step": "easy",
+    "other": "medium",
+}
+
+
+def routing_enabled():
+    return os.getenv("LLM_ROUTING", "0") == "1"
+
+
+def classify_failure(error_message):
+    if not error_message:
+        return "other"
+    for failure, pattern in FAILURE_PATTERNS:
+        if pattern.search(error_message):
+            return failure
+    return "other"
+
+
+def app_seen_before(app, outputs_dir="agent_outputs"):
+    """True if a previous run for `app` completed (per its checkpoint.json)."""
+    if not app:
+        return False
+    for path in Path(outputs_dir).glob("*/checkpoint.json"):
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if checkpoint.get("app") == app and checkpoint.get("completed"):
+            return True
+    return False
+
+
+def classify_request(agent, prompt, error_message=None, app_seen=True):
+    """
+    Features used for routing:
+      - planner / decomposer / subgoal_planner: new apps are hard, known apps medium
+      - repair: difficulty from the failure type (selector typos are easy)
+      - either: very large prompts are bumped one level
+    """
+    tokens = estimate_tokens(prompt)
+    failure = None
+    if agent != "repair":
+        difficulty = "medium" if app_seen else "hard"
+    else:
+        failure = classify_failure(error_message)
+        difficulty = FAILURE_DIFFICULTY[failure]
+
+    level = DIFFICULTY_TIER[difficulty]
+    if tokens > LARGE_PROMPT_TOKENS:
+        level = min(level + 1, len(DIFFICULTY_NAMES) - 1)
+
+    return {
+        "agent": agent,
+        "difficulty": DIFFICULTY_NAMES[level],
+        "tokens": tokens,
+        "failure": failure,
+        "app_seen": app_seen,
+    }
+
+
+class Router:
+    """
+    Picks a model tier per request from its difficulty and live stats, and
+    escalates to the next tier when a response fails validation (here) or
+    the resulting step fails execution (caller passes min_tier).
+    """
+
+    def __init__(self, stats=None, tiers=MODEL_TIERS, min_success=0.6,
+                 max_latency=None, min_samples=5, explore=0.05):
+        self.stats = stats or get_model_stats()
+        self.tiers = list(tiers)
+        self.min_success = min_success
+        self.max_latency = max_latency
+        self.min_samples = min_samples
+        # Chance of trying a tier anyway that the stats say to skip, so it
+        # keeps getting fresh samples and can recover
+        self.explore = explore
+        # Model/tier that produced the last accepted response
+        self.last_decision = None
+
+    @classmethod
+    def from_env(cls):
+        max_latency = os.getenv("LLM_ROUTER_MAX_LATENCY")
+        return cls(
+            min_success=float(os.getenv("LLM_ROUTER_MIN_SUCCESS", "0.6")),
+            max_latency=float(max_latency) if max_latency else None,
+            explore=float(os.getenv("LLM_ROUTER_EXPLORE", "0.05")),
+        )
+
+    def choose(self, features, min_tier=0):
+        """
+        Cheapest tier at or above the request's difficulty (and `min_tier`)
+        whose recent success rate for this agent kind and median latency are
+        acceptable. Tiers without enough samples yet are given the benefit of
+        the doubt, and a skipped tier is still tried with probability `explore`.
+        """
+        start = max(DIFFICULTY_TIER[features["difficulty"]], min_tier)
+        start = min(start, len(self.tiers) - 1)
+
+        for tier in range(start, len(self.tiers)):
+            model = self.tiers[tier]
+            if self._acceptable(model, features["agent"]) or random.random() < self.explore:
+                return tier
+        return start
+
+    def _acceptable(self, model, agent):
+        success = self.stats.success_rate(model, agent, min_samples=self.min_samples)
+        if success is not None and success < self.min_success:
+            return False
+        if self.max_latency is not None and self.stats.samples(model) >= self.min_samples:
+            if self.stats.percentile(model, 50) > self.max_latency:
+                return False
+        return True
+
+    def call(self, prompt, api_key, validator, features, tracker=None, step=None, min_tier=0):
+        """
+        Sends `prompt` to the chosen tier, escalating on invalid output.
+        Returns the response text (the last one if every tier was invalid).
+        """
+        tier = self.choose(features, min_tier=min_tier)
+        text = None
+
+        while tier < len(self.tiers):
+            model = self.tiers[tier]
+            print(f"[ROUTER] {features['agent']} ({features['difficulty']}, "
+                  f"~{features['tokens']} tokens) -> {model}")
+
+            if hedging_enabled() and tier + 1 < len(self.tiers):
+                config = {**hedge_config(), "secondary": self.tiers[tier + 1]}
+                text, model = hedged_call(prompt, api_key, validator, primary=model, stats=self.stats,
+                                          tracker=tracker, agent=features["agent"], step=step, **config)
+                valid = validator(text)
+            else:
+                started = time.perf_counter()
+                text = _call_model(model, prompt, api_key, tracker=tracker,
+                                   agent=features["agent"], step=step)
+                valid = validator(text)
+                self.stats.record(model, time.perf_counter() - started, valid)
+
+            if valid:
+                self.last_decision = {"model": model, "tier": self.tiers.index(model), **features}
+                # A repair only counts once its step has run (see record_outcome)
+                if features["agent"] != "repair":
+                    self.stats.record_outcome(model, features["agent"], True)
+                return text
+
+            self.stats.record_outcome(model, features["agent"], False)
+            print(f"[ROUTER] {model} returned invalid output, escalating")
+            tier = self.tiers.index(model) + 1
+
+        self.last_decision = {"model": self.tiers[-1], "tier": len(self.tiers) - 1, **features}
+        return text
+
+    def record_outcome(self, success):
+        """Records whether the step from the last accepted response executed."""
+        if self.last_decision is not None:
+            self.stats.record_outcome(self.last_decision["model"], self.last_decision["agent"], success)
+
+    def can_escalate(self):
+        return self.last_decision is not None and self.last_decision["tier"] + 1 < len(self.tiers)
+
+    def next_tier(self):
+        return self.last_decision["tier"] + 1 if self.last_decision else 0
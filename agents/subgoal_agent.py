@@ -0,0 +1,107 @@
+#Plan - C (hierarchical: decompose)
+prompt_C = """
+Return ONLY a JSON array of subgoals. Do NOT include explanations, markdown, or extra text.
+
+Your role:
+You split a long browser workflow into an ordered list of small subgoals.
+Each subgoal must be achievable with roughly 2-12 Playwright actions on the current screen(s),
+and must leave the UI in a state from which the next subgoal can start.
+
+Rules:
+- The first subgoal MUST open the relevant application
+  (Notion -> https://www.notion.so, Linear -> https://linear.app, otherwise infer the site).
+- Repetitive work (e.g. "rename every issue in the board") becomes one subgoal per item or small batch.
+- Do not describe selectors or clicks; describe outcomes.
+
+Each subgoal is an object with keys:
+- goal: what must be true when the subgoal is done
+- done_when: the visible UI evidence that it is done
+
+Task:
+{TASK_DESCRIPTION}
+"""
+
+
+#Plan - D (hierarchical: plan one subgoal just in time)
+prompt_D = """
+Return ONLY a JSON array of steps. Do NOT include explanations, markdown, or extra text.
+
+You are planning Playwright steps for ONE subgoal of a longer workflow, using the page as it is right now.
+
+1. overall task:
+    {TASK_DESCRIPTION}
+
+2. progress so far (rolling summary):
+    {HISTORY}
+
+3. current subgoal:
+    {SUBGOAL}
+
+4. current url:
+    {CURRENT_URL}
+
+5. semantic_dom (one element per line: [index] tag role "text" attributes selector=...):
+    {SEMANTIC_DOM}
+
+6. accessibility_tree (indented by depth: role "name" properties):
+    {ACCESSIBILITY_TREE}
+
+Rules:
+- Plan ONLY the steps for the current subgoal, at most {MAX_STEPS} steps.
+- If the current page already satisfies the subgoal, return [].
+- Use selectors that appear in semantic_dom / accessibility_tree; prefer data-testid, aria-label, role and visible text.
+- Every semantic_dom selector= matches exactly one element; copy it verbatim, preferring a higher stability.
+- Each step is a dictionary with keys: action, selector (if needed), value (if needed), description.
+- Allowed actions:
+  ["goto", "click", "wait_for", "type", "press", "hover", "screenshot",
+    "set_title", "keyboard_type", "keyboard_press", "scroll_to", "scroll_by",
+    "select_option", "upload_file", "frame_click", "frame_type",
+    "wait", "wait_for_navigation"]
+- Every UI-changing action must be followed by a screenshot step.
+- Output must be strictly valid JSON.
+"""
+
+
+import json
+
+from agents.call_llm import call_o3_mini
+from agents.hedging import hedging_enabled, hedge_config, hedged_call
+from agents.router import classify_request
+from agents.validation import is_valid_subgoals_response, is_valid_subgoal_plan_response
+
+
+def _complete(prompt, api_key, validator, agent, tracker=None, router=None, step=None, app_seen=True):
+    if router is not None:
+        features = classify_request(agent, prompt, app_seen=app_seen)
+        return router.call(prompt, api_key, validator, features, tracker=tracker, step=step)
+    if hedging_enabled():
+        response, _ = hedged_call(prompt, api_key, validator, primary="o3-mini",
+                                  tracker=tracker, agent=agent, step=step, **hedge_config())
+        return response
+    return call_o3_mini(prompt, api_key, tracker=tracker, agent=agent, step=step)
+
+
+def decompose_task(task_description, api_key, tracker=None, router=None, app_seen=True):
+    """
+    Splits the task into an ordered JSON array of {goal, done_when} subgoals.
+    """
+    prompt = prompt_C.replace("{TASK_DESCRIPTION}", task_description)
+    return _complete(prompt, api_key, is_valid_subgoals_response, "decomposer",
+                     tracker=tracker, router=router, app_seen=app_seen)
+
+
+def plan_subgoal(task_description, subgoal, history, current_url, semantic_dom, accessibility_tree,
+                 api_key, tracker=None, router=None, step_index=None, max_steps=12, app_seen=True):
+    """
+    Plans the steps for a single subgoal from the current page state and the
+    rolling history summary. Returns a JSON array of steps ([] if already done).
+    """
+    prompt = prompt_D.replace("{TASK_DESCRIPTION}", task_description)
+    prompt = prompt.replace("{HISTORY}", history)
+    prompt = prompt.replace("{SUBGOAL}", json.dumps(subgoal))
+    prompt = prompt.replace("{CURRENT_URL}", current_url)
+    prompt = prompt.replace("{MAX_STEPS}", str(max_steps))
+    prompt = prompt.replace("{SEMANTIC_DOM}", semantic_dom)
+    prompt = prompt.replace("{ACCESSIBILITY_TREE}", accessibility_tree)
+    return _complete(prompt, api_key, is_valid_subgoal_plan_response, "subgoal_planner",
+                     tracker=tracker, router=router, step=step_index, app_seen=app_seen)
@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+# USD per 1M tokens: (input, cached input, output). Reasoning tokens bill as output.
+MODEL_PRICING = {
+    "o3-mini": (1.10, 0.55, 4.40),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-5.1": (1.25, 0.125, 10.00),
+}
+
+# Largest max_output_tokens each model accepts; the API rejects larger values
+MAX_OUTPUT_TOKENS = {
+    "o3-mini": 100_000,
+    "gpt-4.1": 32_768,
+    "gpt-5.1": 128_000,
+}
+
+
+# Below this output allowance a call cannot produce a usable step (the API rejects
+# max_output_tokens < 16, and reasoning models spend small caps on reasoning alone)
+MIN_OUTPUT_TOKENS = 256
+
+
+class BudgetExceededError(Exception):
+    """Raised before an LLM call that would push the run over its token or cost budget."""
+
+
+def estimate_tokens(text):
+    """Cheap prompt-size estimate (~4 characters per token) used for budget checks."""
+    return (len(text) + 3) // 4
+
+
+def estimate_cost(model, input_tokens, output_tokens, cached_tokens=0):
+    price_in, price_cached, price_out = MODEL_PRICING.get(model, (0.0, 0.0, 0.0))
+    uncached = max(input_tokens - cached_tokens, 0)
+    return (uncached * price_in + cached_tokens * price_cached + output_tokens * price_out) / 1_000_000
+
+
+class UsageTracker:
+    """
+    Collects token usage for every LLM call of a run, attributed to the
+    agent (planner/repair) and step index, and enforces per-run budgets.
+
+    Each call is appended to <run_folder>/usage.jsonl and the running totals
+    are rewritten to <run_folder>/usage_summary.json.
+    """
+
+    def __init__(self, run_folder=None, max_tokens=None, max_cost=None):
+        self.run_folder = Path(run_folder) if run_folder else None
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.reasoning_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.by_agent = {}
+        # Budget granted to calls still in flight (see check_budget)
+        self._reserved_tokens = 0
+        self._reserved_cost = 0.0
+        # Hedged calls reserve and record from worker threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, run_folder=None):
+        """
+        Reads LLM_MAX_TOKENS_PER_RUN / LLM_MAX_COST_PER_RUN (unset = unlimited).
+        Totals already recorded in the run folder (a resumed run) count against the budget.
+        """
+        max_tokens = os.getenv("LLM_MAX_TOKENS_PER_RUN")
+        max_cost = os.getenv("LLM_MAX_COST_PER_RUN")
+        tracker = cls(
+            run_folder=run_folder,
+            max_tokens=int(max_tokens) if max_tokens else None,
+            max_cost=float(max_cost) if max_cost else None,
+        )
+        tracker.restore()
+        return tracker
+
+    def restore(self):
+        """Loads running totals from an existing usage_summary.json, if any."""
+        if self.run_folder is None:
+            return
+        summary_path = self.run_folder / "usage_summary.json"
+        if not summary_path.exists():
+            return
+        with open(summary_path) as f:
+            summary = json.load(f)
+        self.calls = summary.get("calls", 0)
+        self.input_tokens = summary.get("input_tokens", 0)
+        self.output_tokens = summary.get("output_tokens", 0)
+        self.reasoning_tokens = summary.get("reasoning_tokens", 0)
+        self.cached_tokens = summary.get("cached_tokens", 0)
+        self.cost = summary.get("cost", 0.0)
+        self.by_agent = summary.get("by_agent", {})
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    # ---------------------------------------------
+    # BUDGET CHECKS
+    # ---------------------------------------------
+    def check_budget(self, model, prompt, agent=None, step=None):
+        """
+        Fails fast if sending `prompt` to `model` cannot fit in the remaining budget,
+        including when fewer than MIN_OUTPUT_TOKENS would be left for the answer.
+
+        The prompt and granted output tokens/cost are reserved until record(),
+        record_aborted() or release() settles them, so concurrent (hedged) calls
+        cannot together overshoot the budget: a hedge backup is granted what is
+        left after the in-flight primary's reservation.
+
+        Returns the reservation; its "max_output_tokens" is the cap to request,
+        at most the model's MAX_OUTPUT_TOKENS (None when the budget is unlimited).
+        """
+        prompt_tokens = estimate_tokens(prompt)
+        prompt_cost = estimate_cost(model, prompt_tokens, 0)
+        where = f"{agent or 'llm'} call" + (f" for step {step + 1}" if step is not None else "")
+
+        with self._lock:
+            used_tokens = self.total_tokens + self._reserved_tokens
+            used_cost = self.cost + self._reserved_cost
+
+            allowance = None
+            if self.max_tokens is not None:
+                remaining = self.max_tokens - used_tokens - prompt_tokens
+                if remaining <= 0:
+                    raise BudgetExceededError(
+                        f"TOKEN_BUDGET_EXCEEDED: {where} needs ~{prompt_tokens} prompt tokens, "
+                        f"{self.max_tokens - used_tokens} of {self.max_tokens} left"
+                    )
+                allowance = remaining
+
+            if self.max_cost is not None:
+                if used_cost + prompt_cost > self.max_cost:
+                    raise BudgetExceededError(
+                        f"COST_BUDGET_EXCEEDED: {where} needs ~${prompt_cost:.4f}, "
+                        f"${self.max_cost - used_cost:.4f} of ${self.max_cost:.2f} left"
+                    )
+                price_out = MODEL_PRICING.get(model, (0.0, 0.0, 0.0))[2]
+                if price_out:
+                    affordable = int((self.max_cost - used_cost - prompt_cost) * 1_000_000 / price_out)
+                    if affordable <= 0:
+                        raise BudgetExceededError(
+                            f"COST_BUDGET_EXCEEDED: no budget left for output of {where}"
+                        )
+                    allowance = min(allowance or affordable, affordable)
+
+            max_output_tokens = None
+            if allowance is not None:
+                if allowance < MIN_OUTPUT_TOKENS:
+                    raise BudgetExceededError(
+                        f"BUDGET_EXCEEDED: only {allowance} output tokens left for {where} "
+                        f"(minimum {MIN_OUTPUT_TOKENS})"
+                    )
+                max_output_tokens = min(allowance, MAX_OUTPUT_TOKENS.get(model, allowance))
+
+            reservation = {
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "max_output_tokens": max_output_tokens,
+                "tokens": prompt_tokens + (max_output_tokens or 0),
+                "cost": prompt_cost + estimate_cost(model, 0, max_output_tokens or 0),
+                "settled": False,
+            }
+            self._reserved_tokens += reservation["tokens"]
+            self._reserved_cost += reservation["cost"]
+        return reservation
+
+    def release(self, reservation):
+        """Returns an unused reservation to the budget (idempotent)."""
+        with self._lock:
+            self._release(reservation)
+
+    def _release(self, reservation):
+        if reservation is None or reservation["settled"]:
+            return
+        reservation["settled"] = True
+        self._reserved_tokens -= reservation["tokens"]
+        self._reserved_cost -= reservation["cost"]
+
+    # ---------------------------------------------
+    # RECORDING
+    # ---------------------------------------------
+    def record(self, model, usage, agent=None, step=None, latency=None, reservation=None):
+        """Records the `usage` object of a Responses API result (may be None)."""
+        details_in = getattr(usage, "input_tokens_details", None)
+        details_out = getattr(usage, "output_tokens_details", None)
+        with self._lock:
+            self._release(reservation)
+            return self._record(
+                model, agent, step, latency,
+                input_tokens=getattr(usage, "input_tokens", 0) or 0,
+                output_tokens=getattr(usage, "output_tokens", 0) or 0,
+                cached_tokens=getattr(details_in, "cached_tokens", 0) or 0,
+                reasoning_tokens=getattr(details_out, "reasoning_tokens", 0) or 0,
+            )
+
+    def record_aborted(self, model, prompt, agent=None, step=None, latency=None):
+        """
+        Records an estimate for a request aborted before it returned usage (the
+        losing leg of a hedged call): the prompt is assumed billed, output unknown.
+        """
+        with self._lock:
+            return self._record(model, agent, step, latency,
+                                input_tokens=estimate_tokens(prompt), aborted=True)
+
+    def _record(self, model, agent, step, latency, input_tokens=0, output_tokens=0,
+                cached_tokens=0, reasoning_tokens=0, aborted=False):
+        cost = estimate_cost(model, input_tokens, output_tokens, cached_tokens)
+
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cached_tokens += cached_tokens
+        self.reasoning_tokens += reasoning_tokens
+        self.cost += cost
+
+        agent_key = agent or "unknown"
+        totals = self.by_agent.setdefault(agent_key, {
+            "calls": 0, "input_tokens": 0, "output_tokens": 0,
+            "reasoning_tokens": 0, "cost": 0.0,
+        })
+        totals["calls"] += 1
+        totals["input_tokens"] += input_tokens
+        totals["output_tokens"] += output_tokens
+        totals["reasoning_tokens"] += reasoning_tokens
+        totals["cost"] += cost
+
+        entry = {
+            "timestamp": time.time(),
+            "agent": agent,
+            "step": step + 1 if step is not None else None,
+            "model": model,
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,
+            "output_tokens": output_tokens,
+            "reasoning_tokens": reasoning_tokens,
+            "cost": round(cost, 6),
+            "latency_s": round(latency, 3) if latency is not None else None,
+        }
+        if aborted:
+            entry["aborted"] = True
+            entry["estimated"] = True
+        self._write(entry)
+        return entry
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": round(self.cost, 6),
+            "max_tokens": self.max_tokens,
+            "max_cost": self.max_cost,
+            "by_agent": self.by_agent,
+        }
+
+    def _write(self, entry):
+        if self.run_folder is None:
+            return
+        self.run_folder.mkdir(exist_ok=True, parents=True)
+        with open(self.run_folder / "usage.jsonl", "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        with open(self.run_folder / "usage_summary.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
@@ -0,0 +1,75 @@
+import json
+
+
+# Must match the allowed actions listed in prompt_A / prompt_B and handled by StepExecutor
+ALLOWED_ACTIONS = {
+    "goto", "click", "wait_for", "type", "press", "hover", "screenshot",
+    "set_title", "keyboard_type", "keyboard_press", "scroll_to", "scroll_by",
+    "select_option", "upload_file", "frame_click", "frame_type",
+    "wait", "wait_for_navigation", "dblclick", "right_click",
+}
+
+SELECTOR_ACTIONS = {
+    "click", "dblclick", "right_click", "wait_for", "type", "press", "hover",
+    "set_title", "scroll_to", "select_option", "upload_file", "frame_click", "frame_type",
+}
+
+VALUE_ACTIONS = {
+    "goto", "type", "press", "set_title", "keyboard_type", "keyboard_press",
+    "select_option", "upload_file", "frame_type", "wait", "scroll_by",
+}
+
+
+def is_valid_step(step):
+    """True if `step` is a dict the executor can run without an obvious error."""
+    if not isinstance(step, dict):
+        return False
+    action = step.get("action")
+    if action not in ALLOWED_ACTIONS:
+        return False
+    if action in SELECTOR_ACTIONS and not step.get("selector"):
+        return False
+    if action in VALUE_ACTIONS and step.get("value") in (None, ""):
+        return False
+    if action in ("frame_click", "frame_type") and not step.get("frame_name"):
+        return False
+    return True
+
+
+def is_valid_plan_response(text):
+    """True if an LLM response parses as a non-empty JSON array of valid steps."""
+    try:
+        steps = json.loads(text)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(steps, list) and bool(steps) and all(is_valid_step(s) for s in steps)
+
+
+def is_valid_step_response(text):
+    """True if an LLM response parses as a single valid JSON step object."""
+    try:
+        step = json.loads(text)
+    except (TypeError, ValueError):
+        return False
+    return is_valid_step(step)
+
+
+def is_valid_subgoal_plan_response(text):
+    """Like is_valid_plan_response, but [] is allowed (subgoal already satisfied)."""
+    try:
+        steps = json.loads(text)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(steps, list) and all(is_valid_step(s) for s in steps)
+
+
+def is_valid_subgoals_response(text):
+    """True if an LLM response parses as a non-empty JSON array of {goal, ...} objects."""
+    try:
+        subgoals = json.loads(text)
+    except (TypeError, ValueError):
+        return False
+    return (
+        isinstance(subgoals, list) and bool(subgoals)
+        and all(isinstance(s, dict) and isinstance(s.get("goal"), str) and s["goal"] for s in subgoals)
+    )
@@ -0,0 +1,665 @@
+import asyncio
+import json
+import re
+import time
+from collections import Counter, defaultdict
+
+
+INTERACTIVE_TAGS = {"button", "a", "input", "textarea", "select"}
+
+# Computed styles requested from DOMSnapshot, in this order
+SNAPSHOT_STYLES = ["display", "visibility", "opacity"]
+
+# AX roles that only structure the tree; their children are hoisted
+AX_SKIPPED_ROLES = {"InlineTextBox", "LineBreak"}
+
+# CDP role names -> the names page.accessibility.snapshot() reports
+AX_ROLE_NAMES = {"RootWebArea": "WebArea", "StaticText": "text"}
+
+# AX properties copied onto snapshot nodes (same names page.accessibility.snapshot uses)
+AX_PROPERTIES = {
+    "autocomplete", "checked", "disabled", "expanded", "focused", "haspopup",
+    "invalid", "keyshortcuts", "level", "modal", "multiline", "multiselectable",
+    "orientation", "pressed", "readonly", "required", "roledescription",
+    "selected", "valuemax", "valuemin", "valuetext",
+}
+
+
+# Selector stability by kind; StepExecutor._extract_semantic_dom uses the same scores
+TEST_ATTRS = ["data-testid", "data-test-id", "data-test", "data-qa", "data-cy"]
+SELECTOR_STABILITY = {
+    "testid": 1.0,
+    "id": 0.9,
+    "name": 0.85,
+    "aria-label": 0.85,
+    "role": 0.8,
+    "placeholder": 0.75,
+    "text": 0.65,
+    "href": 0.6,
+    "class": 0.45,
+}
+SELECTOR_ATTRS = TEST_ATTRS + ["id", "name", "aria-label", "placeholder", "href", "class"]
+
+# Roles Playwright's role= engine cannot target (or that match half the page)
+NON_TARGETABLE_ROLES = {"generic", "none", "presentation"}
+
+# Playwright's elementText() (used by :text-is) leaves these subtrees out
+TEXT_SKIPPED_TAGS = {"script", "noscript", "style", "head"}
+# Longest text used in a :text-is() selector (same limit as the evaluate path)
+MAX_SELECTOR_TEXT = 50
+
+# CSS-in-JS classes, React useId ids, build hashes ...
+_HAS_LONG_NUMBER = re.compile(r"\d{3,}")
+# Ids/classes usable in a selector without CSS escaping
+_CSS_IDENT = re.compile(r"^[A-Za-z_][\w-]*$")
+
+
+class CDPSnapshotExtractor:
+    """
+    Single-pass UI state extractor built on the Chrome DevTools Protocol.
+
+    One DOMSnapshot.captureSnapshot call (all frames + shadow roots, with
+    layout) and one Accessibility.getFullAXTree call per same-process frame
+    run concurrently and produce:
+      - semantic_dom: rendered, visible interactive nodes in the same shape
+        as StepExecutor._extract_semantic_dom, plus viewport/AX fields
+      - accessibility: a nested tree of the main frame shaped like
+        page.accessibility.snapshot()
+      - stats: node counts, truncation flags and per-phase timings (ms)
+
+    Nothing is read through innerText, so no layout is forced in the page.
+    """
+
+    def __init__(self, max_nodes=1500, max_ax_nodes=3000, max_text=200):
+        self.max_nodes = max_nodes
+        self.max_ax_nodes = max_ax_nodes
+        self.max_text = max_text
+        self._sessions = {}
+
+    async def _session(self, page):
+        session = self._sessions.get(page)
+        if session is None:
+            session = await page.context.new_cdp_session(page)
+            self._sessions[page] = session
+
+            async def on_close(_):
+                await _detach(self._sessions.pop(page, None))
+
+            page.once("close", on_close)
+        return session
+
+    async def capture(self, page):
+        t0 = time.perf_counter()
+        session = await self._session(page)
+
+        frame_tree = await session.send("Page.getFrameTree")
+        main_frame = frame_tree["frameTree"]["frame"]["id"]
+        frame_ids = _frame_ids(frame_tree["frameTree"])
+        snapshot, *ax_trees = await asyncio.gather(
+            session.send("DOMSnapshot.captureSnapshot", {
+                "computedStyles": SNAPSHOT_STYLES,
+                "includeDOMRects": True,
+            }),
+            *(_full_ax_tree(session, frame_id, frame_id == main_frame) for frame_id in frame_ids),
+        )
+        t1 = time.perf_counter()
+
+        viewport = page.viewport_size or {"width": 1280, "height": 720}
+        ax_by_frame = dict(zip(frame_ids, ax_trees))
+
+        semantic_dom, dom_stats = self._build_semantic_dom(snapshot, ax_by_frame, viewport)
+        t2 = time.perf_counter()
+
+        accessibility, ax_stats = self._build_accessibility_tree(ax_by_frame[main_frame])
+        t3 = time.perf_counter()
+
+        stats = {
+            **dom_stats,
+            **ax_stats,
+            "capture_ms": round((t1 - t0) * 1000, 1),
+            "dom_build_ms": round((t2 - t1) * 1000, 1),
+            "ax_build_ms": round((t3 - t2) * 1000, 1),
+            "total_ms": round((t3 - t0) * 1000, 1),
+        }
+        return semantic_dom, accessibility, stats
+
+    # ---------------------------------------------
+    # SEMANTIC DOM FROM DOMSnapshot
+    # ---------------------------------------------
+    def _build_semantic_dom(self, snapshot, ax_by_frame, viewport):
+        strings = snapshot["strings"]
+        documents = snapshot["documents"]
+        ax_by_backend = _index_ax_nodes([node for nodes in ax_by_frame.values() for node in nodes])
+
+        # Owner iframe of each child document: doc index -> (owner doc, owner node)
+        owners = {}
+        for doc_idx, doc in enumerate(documents):
+            content = doc["nodes"].get("contentDocumentIndex", {})
+            for node_idx, child_doc in zip(content.get("index", []), content.get("value", [])):
+                owners[child_doc] = (doc_idx, node_idx)
+
+        layouts = [_layout_index(doc["layout"]) for doc in documents]
+        offsets = {}
+
+        def doc_offset(doc_idx):
+            # Translate document coordinates into top-level viewport coordinates
+            if doc_idx in offsets:
+                return offsets[doc_idx]
+            doc = documents[doc_idx]
+            x = -doc.get("scrollOffsetX", 0)
+            y = -doc.get("scrollOffsetY", 0)
+            owner = owners.get(doc_idx)
+            if owner is not None:
+                owner_doc, owner_node = owner
+                ox, oy = doc_offset(owner_doc)
+                layout_pos = layouts[owner_doc].get(owner_node)
+                if layout_pos is not None:
+                    bx, by = documents[owner_doc]["layout"]["bounds"][layout_pos][:2]
+                    x, y = x + bx + ox, y + by + oy
+            offsets[doc_idx] = (x, y)
+            return offsets[doc_idx]
+
+        in_view, off_view = [], []
+        total_nodes = rendered = interactive = 0
+
+        for doc_idx, doc in enumerate(documents):
+            nodes = doc["nodes"]
+            layout = doc["layout"]
+            layout_pos = layouts[doc_idx]
+            parent = nodes["parentIndex"]
+            node_names = nodes["nodeName"]
+            node_types = nodes["nodeType"]
+            node_values = nodes["nodeValue"]
+            attributes = nodes["attributes"]
+            backend_ids = nodes["backendNodeId"]
+            clickable = set(nodes.get("isClickable", {}).get("index", []))
+            n = len(parent)
+            total_nodes += n
+            rendered += len(layout_pos)
+
+            frame_name = None
+            if doc_idx in owners:
+                owner_doc, owner_node = owners[doc_idx]
+                owner_attrs = _attrs(strings, documents[owner_doc]["nodes"]["attributes"][owner_node])
+                frame_name = owner_attrs.get("name") or owner_attrs.get("id") or f"frame_{doc_idx}"
+
+            # Rendered text, aggregated bottom-up once (children always follow their parent)
+            text_parts = [None] * n
+            texts = [""] * n
+            for i in range(n - 1, -1, -1):
+                if node_types[i] == 3:
+                    texts[i] = strings[node_values[i]] if i in layout_pos and node_values[i] >= 0 else ""
+                elif text_parts[i]:
+                    texts[i] = " ".join(reversed(text_parts[i])).strip()[:self.max_text]
+                p = parent[i]
+                if p >= 0 and texts[i]:
+                    if text_parts[p] is None:
+                        text_parts[p] = []
+                    text_parts[p].append(texts[i])
+                text_parts[i] = None
+
+            ox, oy = doc_offset(doc_idx)
+            vw, vh = viewport["width"], viewport["height"]
+            index = _SelectorIndex(strings, nodes)
+            # role= matches every element of the frame with that role (headings,
+            # list items, ...), not just the interactive ones returned here
+            for ax_node in ax_by_frame.get(strings[doc["frameId"]], []):
+                index.add_role(_ax_value(ax_node.get("role")), _ax_value(ax_node.get("name")))
+
+            for i in range(n):
+                if node_types[i] != 1 or i not in layout_pos:
+                    continue
+                tag = index.tags[i]
+                attrs = index.attrs[i]
+                if not (tag in INTERACTIVE_TAGS or "role" in attrs or "contenteditable" in attrs):
+                    continue
+                interactive += 1
+
+                pos = layout_pos[i]
+                display, visibility, opacity = (
+                    strings[s] if s >= 0 else "" for s in layout["styles"][pos]
+                )
+                x, y, w, h = layout["bounds"][pos]
+                if display == "none" or visibility == "hidden" or opacity == "0" or w <= 0 or h <= 0:
+                    continue
+
+                x, y = x + ox, y + oy
+                visible_in_viewport = x < vw and y < vh and x + w > 0 and y + h > 0
+
+                ax_node = ax_by_backend.get(backend_ids[i], {})
+                node = {
+                    "tag": tag,
+                    "text": texts[i],
+                    "aria": attrs.get("aria-label"),
+                    "role": attrs.get("role"),
+                    "placeholder": attrs.get("placeholder"),
+                    "href": attrs.get("href"),
+                    "type": attrs.get("type"),
+                    "selector": None,
+                    "stability": 0,
+                    "ax_role": ax_node.get("role"),
+                    "ax_name": ax_node.get("name") or None,
+                    "in_viewport": visible_in_viewport,
+                    "bounds": [round(x), round(y), round(w), round(h)],
+                }
+                if frame_name is not None:
+                    node["frame_name"] = frame_name
+                if i in clickable:
+                    node["clickable"] = True
+
+                (in_view if visible_in_viewport else off_view).append((node, index, i))
+
+        # In-viewport nodes first, then the rest of the page, up to the cap.
+        # Selectors are only built for the nodes that are returned.
+        semantic_dom = []
+        for node, index, i in (in_view + off_view)[:self.max_nodes]:
+            node["selector"], node["stability"] = index.selector(i, node["ax_role"], node["ax_name"])
+            semantic_dom.append(node)
+        stats = {
+            "documents": len(documents),
+            "dom_nodes": total_nodes,
+            "rendered_nodes": rendered,
+            "interactive_nodes": interactive,
+            "visible_nodes": len(in_view) + len(off_view),
+            "in_viewport_nodes": len(in_view),
+            "returned_nodes": len(semantic_dom),
+            "dom_truncated": len(in_view) + len(off_view) > self.max_nodes,
+        }
+        return semantic_dom, stats
+
+    # ---------------------------------------------
+    # ACCESSIBILITY TREE FROM getFullAXTree
+    # ---------------------------------------------
+    def _build_accessibility_tree(self, ax_nodes):
+        by_id = {node["nodeId"]: node for node in ax_nodes}
+        roots = [node for node in ax_nodes if not node.get("parentId")]
+        if not roots:
+            return None, {"ax_nodes": len(ax_nodes), "ax_returned_nodes": 0, "ax_truncated": False}
+
+        # Iterative post-order walk: huge pages nest far deeper than the recursion limit.
+        # results[nodeId] holds the snapshot nodes an AX node contributes to its parent
+        # (itself, or its hoisted children when it is skipped).
+        results = {}
+        kept = 0
+        truncated = False
+        stack = [(roots[0], False)]
+
+        while stack:
+            ax_node, visited = stack.pop()
+            child_ids = [c for c in ax_node.get("childIds", []) if c in by_id]
+            if not visited:
+                stack.append((ax_node, True))
+                for child_id in reversed(child_ids):
+                    stack.append((by_id[child_id], False))
+                continue
+
+            children = []
+            for child_id in child_ids:
+                children.extend(results.pop(child_id, []))
+
+            role = _ax_value(ax_node.get("role"))
+            role = AX_ROLE_NAMES.get(role, role)
+            name = _ax_value(ax_node.get("name")) or ""
+
+            skip = (
+                ax_node.get("ignored")
+                or role in AX_SKIPPED_ROLES
+                or (role in ("generic", "none") and not name)
+            )
+            if not skip and kept >= self.max_ax_nodes:
+                skip = truncated = True
+            if skip:
+                results[ax_node["nodeId"]] = children
+                continue
+
+            kept += 1
+            node = {"role": role, "name": name}
+            value = _ax_value(ax_node.get("value"))
+            if value not in (None, ""):
+                node["value"] = value
+            description = _ax_value(ax_node.get("description"))
+            if description:
+                node["description"] = description
+            for prop in ax_node.get("properties", []):
+                if prop["name"] in AX_PROPERTIES:
+                    prop_value = _ax_value(prop.get("value"))
+                    if prop_value not in (None, False, ""):
+                        node[prop["name"]] = prop_value
+
+            # Text leaves already folded into this node's name add nothing
+            children = [
+                c for c in children
+                if not (c["role"] == "text" and "children" not in c and c["name"] in name)
+            ]
+            if children:
+                node["children"] = children
+            results[ax_node["nodeId"]] = [node]
+
+        converted = results.get(roots[0]["nodeId"], [])
+        tree = converted[0] if len(converted) == 1 else {"role": "WebArea", "name": "", "children": converted}
+        return tree, {
+            "ax_nodes": len(ax_nodes),
+            "ax_returned_nodes": kept,
+            "ax_truncated": truncated,
+        }
+
+
+def _frame_ids(frame_tree):
+    """Ids of the frame and all its descendants, from Page.getFrameTree."""
+    ids = [frame_tree["frame"]["id"]]
+    for child in frame_tree.get("childFrames", []):
+        ids.extend(_frame_ids(child))
+    return ids
+
+
+async def _full_ax_tree(session, frame_id, main):
+    """AX nodes of one frame; out-of-process (cross-site) iframes yield none."""
+    try:
+        ax = await session.send("Accessibility.getFullAXTree", {"frameId": frame_id})
+    except Exception:
+        if main:
+            raise
+        return []
+    return ax.get("nodes", [])
+
+
+async def _detach(session):
+    if session is None:
+        return
+    try:
+        await session.detach()
+    except Exception:
+        # Already gone with its page
+        pass
+
+
+def _layout_index(layout):
+    """Maps node index -> position in the layout arrays (only rendered nodes have one)."""
+    return {node_idx: pos for pos, node_idx in enumerate(layout["nodeIndex"])}
+
+
+def _attrs(strings, flat):
+    return {strings[flat[i]]: strings[flat[i + 1]] for i in range(0, len(flat), 2)}
+
+
+def _ax_value(value):
+    if not value:
+        return None
+    raw = value.get("value")
+    if value.get("type") == "tristate":
+        return "mixed" if raw == "mixed" else raw == "true"
+    if value.get("type") == "booleanOrUndefined" and isinstance(raw, str):
+        return raw == "true"
+    return raw
+
+
+def _index_ax_nodes(ax_nodes):
+    index = {}
+    for node in ax_nodes:
+        backend_id = node.get("backendDOMNodeId")
+        if backend_id is None or node.get("ignored"):
+            continue
+        index[backend_id] = {
+            "role": _ax_value(node.get("role")),
+            "name": _ax_value(node.get("name")),
+        }
+    return index
+
+
+def _looks_generated(value):
+    """
+    True for ids/classes that change between builds or sessions (css-1x9f2k,
+    :r12:, ...) or that would need CSS escaping.
+    """
+    return bool(
+        not _CSS_IDENT.match(value) or _HAS_LONG_NUMBER.search(value)
+        or any(len(p) >= 5 and re.search(r"\d", p) and re.search(r"[a-z]", p, re.I)
+               for p in re.split(r"[-_]", value))
+    )
+
+
+def _css_string(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ") + '"'
+
+
+class _SelectorIndex:
+    """
+    Match counts for one snapshot document, so selectors can be checked for
+    uniqueness without round trips to the page. Mirrors the candidate order
+    of StepExecutor._extract_semantic_dom:
+        test id > id > name > aria-label > role+name > placeholder > text
+        > href > stable classes > shortest unique ancestor path
+    """
+
+    def __init__(self, strings, nodes):
+        parent = nodes["parentIndex"]
+        node_types = nodes["nodeType"]
+        self.parent = parent
+        self.tags = {}
+        self.attrs = {}
+        self.nth = {}
+        self.attr_counts = Counter()
+        self.text_counts = Counter()
+        siblings = Counter()
+
+        for i in range(len(parent)):
+            if node_types[i] != 1:
+                continue
+            tag = strings[nodes["nodeName"][i]].lower()
+            attrs = _attrs(strings, nodes["attributes"][i])
+            self.tags[i] = tag
+            self.attrs[i] = attrs
+            for key in SELECTOR_ATTRS:
+                if key == "class":
+                    for cls in attrs.get("class", "").split():
+                        self.attr_counts[(tag, "class", cls)] += 1
+                elif attrs.get(key):
+                    self.attr_counts[(tag, key, attrs[key])] += 1
+                    self.attr_counts[(None, key, attrs[key])] += 1
+            siblings[(parent[i], tag)] += 1
+            self.nth[i] = siblings[(parent[i], tag)]
+        self.siblings = siblings
+        self.match_texts = self._index_texts(strings, nodes)
+        self.roles = defaultdict(list)
+        self._role_counts = {}
+        self._levels = []
+
+    def _index_texts(self, strings, nodes):
+        """
+        Text of every element as Playwright's :text-is() compares it: all
+        descendant text nodes concatenated with no separator (shadow roots
+        last, script/style skipped), whitespace then collapsed. Texts longer
+        than MAX_SELECTOR_TEXT are None. :text-is() also matches an element
+        one of whose own runs of text equals the text, so those runs are
+        counted as well.
+        """
+        parent = self.parent
+        node_types = nodes["nodeType"]
+        node_values = nodes["nodeValue"]
+        children = defaultdict(list)
+        for i, p in enumerate(parent):
+            if p >= 0:
+                children[p].append(i)
+
+        def raw(i):
+            return strings[node_values[i]] if node_values[i] >= 0 else ""
+
+        # pieces[i]: collapsed text with one space kept per leading/trailing
+        # whitespace run, so joining pieces collapses like the full text would
+        pieces = {}
+        match_texts = {}
+        for i in range(len(parent) - 1, -1, -1):
+            if node_types[i] == 3:
+                pieces[i] = _text_piece(raw(i))
+                continue
+            tag = self.tags.get(i)
+            attrs = self.attrs.get(i, {})
+            runs = []
+            if tag in TEXT_SKIPPED_TAGS:
+                piece = ""
+            elif tag == "input" and attrs.get("type") in ("submit", "button"):
+                piece = _text_piece(attrs.get("value", ""))
+            else:
+                piece, run, shadow = "", "", []
+                for c in children[i]:
+                    if node_types[c] == 8:
+                        continue
+                    if node_types[c] == 3:
+                        run += raw(c)
+                    else:
+                        runs.append(run)
+                        run = ""
+                        if node_types[c] == 11:
+                            shadow.append(c)
+                            continue
+                    piece = _join_pieces(piece, pieces.get(c, ""))
+                runs.append(run)
+                for c in shadow:
+                    piece = _join_pieces(piece, pieces.get(c, ""))
+                if piece is not None and len(piece.strip()) > MAX_SELECTOR_TEXT:
+                    piece = None
+            pieces[i] = piece
+            if tag is None:
+                continue
+
+            text = piece.strip() if piece is not None else None
+            match_texts[i] = text
+            matched = {text} if text else set()
+            for run in runs:
+                run = _normalize_text(run)
+                if run and len(run) <= MAX_SELECTOR_TEXT:
+                    matched.add(run)
+            for t in matched:
+                self.text_counts[(tag, t)] += 1
+        return match_texts
+
+    def add_role(self, role, name):
+        """Registers an AX node's role/name (any node of the frame, not just returned ones)."""
+        if role and name:
+            self.roles[role].append(name.lower())
+
+    def _role_count(self, role, name):
+        # role=...[name=...] is a case-insensitive substring match
+        key = (role, name)
+        if key not in self._role_counts:
+            needle = name.lower()
+            self._role_counts[key] = sum(needle in n for n in self.roles[role])
+        return self._role_counts[key]
+
+    def selector(self, i, ax_role=None, ax_name=None):
+        """Returns (selector, stability) for element i; every selector matches only i."""
+        tag = self.tags[i]
+        attrs = self.attrs[i]
+
+        def unique(key, value):
+            return self.attr_counts[(tag, key, value)] == 1
+
+        for attr in TEST_ATTRS:
+            if attrs.get(attr) and unique(attr, attrs[attr]):
+                return f"{tag}[{attr}={_css_string(attrs[attr])}]", SELECTOR_STABILITY["testid"]
+        element_id = attrs.get("id")
+        if element_id and not _looks_generated(element_id) and unique("id", element_id):
+            return f"{tag}#{element_id}", SELECTOR_STABILITY["id"]
+        for key in ("name", "aria-label"):
+            if attrs.get(key) and unique(key, attrs[key]):
+                return f"{tag}[{key}={_css_string(attrs[key])}]", SELECTOR_STABILITY[key]
+        if (ax_role and ax_name and ax_role not in NON_TARGETABLE_ROLES and ax_role.isalpha()
+                and ax_role.islower() and len(ax_name) <= 80 and self._role_count(ax_role, ax_name) == 1):
+            return f"role={ax_role}[name={json.dumps(ax_name)}]", SELECTOR_STABILITY["role"]
+        if attrs.get("placeholder") and unique("placeholder", attrs["placeholder"]):
+            return f"{tag}[placeholder={_css_string(attrs['placeholder'])}]", SELECTOR_STABILITY["placeholder"]
+        text = self.match_texts.get(i)
+        if text and self.text_counts[(tag, text)] == 1:
+            return f"{tag}:text-is({json.dumps(text)})", SELECTOR_STABILITY["text"]
+        href = attrs.get("href")
+        if href and not href.startswith("javascript:") and len(href) <= 120 and unique("href", href):
+            return f"{tag}[href={_css_string(href)}]", SELECTOR_STABILITY["href"]
+        for cls in attrs.get("class", "").split():
+            if not _looks_generated(cls) and unique("class", cls):
+                return f"{tag}.{cls}", SELECTOR_STABILITY["class"]
+        return self._ancestor_path(i)
+
+    def _anchor(self, i):
+        attrs = self.attrs[i]
+        for attr in TEST_ATTRS:
+            value = attrs.get(attr)
+            if value and self.attr_counts[(None, attr, value)] == 1:
+                return f"[{attr}={_css_string(value)}]"
+        element_id = attrs.get("id")
+        if element_id and not _looks_generated(element_id) and self.attr_counts[(None, "id", element_id)] == 1:
+            return f"#{element_id}"
+        return None
+
+    def _segment(self, i, exact=False):
+        """
+        (tag, nth-of-type) of element i. nth is dropped for an only child of its
+        tag unless `exact`: a bare tag also matches elements that have siblings.
+        """
+        tag = self.tags[i]
+        if exact or self.siblings[(self.parent[i], tag)] > 1:
+            return tag, self.nth[i]
+        return tag, None
+
+    def _path_level(self, length):
+        """
+        Hash of every element's exact path suffix (itself and its length-1
+        nearest ancestors) plus the count of each hash. Each level is built
+        from the one below in O(n) and cached, so checking every returned node
+        costs O(n * depth) per document rather than O(n) per node and level.
+        """
+        while len(self._levels) < length:
+            if not self._levels:
+                level = {i: hash(self._segment(i, exact=True)) for i in self.tags}
+            else:
+                below = self._levels[-1][0]
+                level = {
+                    i: hash((self._segment(i, exact=True), below[self.parent[i]]))
+                    for i in self.tags if self.parent[i] in below
+                }
+            self._levels.append((level, Counter(level.values())))
+        return self._levels[length - 1]
+
+    def _ancestor_path(self, i):
+        """
+        Shortest `a:nth-of-type(k) > b:nth-of-type(l)` path that matches only i,
+        stopping early at an ancestor with a unique test id / stable id (the
+        path below such an anchor is unique by construction).
+        """
+        chain = [i]
+        while True:
+            level, counts = self._path_level(len(chain))
+            if counts[level[i]] == 1:
+                segments = [self._segment(j, exact=True) for j in reversed(chain)]
+                return _join_path([], segments), round(max(0.3 - 0.02 * (len(chain) - 1), 0.1), 2)
+            current = self.parent[chain[-1]]
+            if current not in self.tags:
+                return None, 0
+            anchor = self._anchor(current)
+            if anchor:
+                segments = [self._segment(j) for j in reversed(chain)]
+                return _join_path([anchor], segments), round(max(0.5 - 0.05 * len(chain), 0.2), 2)
+            chain.append(current)
+
+
+def _normalize_text(value):
+    """Playwright's normalizeWhiteSpace(): drop zero-width spaces, trim, collapse runs."""
+    return " ".join(value.replace("\u200b", "").split())
+
+
+def _text_piece(value):
+    value = value.replace("\u200b", "")
+    core = " ".join(value.split())
+    if not core:
+        return " " if value else ""
+    return (" " if value[0].isspace() else "") + core + (" " if value[-1].isspace() else "")
+
+
+def _join_pieces(a, b):
+    if a is None or b is None:
+        return None
+    return a + b[1:] if a.endswith(" ") and b.startswith(" ") else a + b
+
+
+def _join_path(prefix, segments):
+    parts = prefix + [f"{tag}:nth-of-type({nth})" if nth else tag for tag, nth in segments]
+    return " > ".join(parts)
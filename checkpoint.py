@@ -0,0 +1,65 @@
+import json
+import os
+import time
+from pathlib import Path
+
+
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(run_folder):
+    return Path(run_folder) / CHECKPOINT_FILE
+
+
+def save_checkpoint(run_folder, state):
+    """
+    Durably writes the run state to <run_folder>/checkpoint.json.
+    The file is written to a temp file, fsynced and atomically renamed, so a
+    crash mid-write leaves the previous checkpoint intact.
+    """
+    path = checkpoint_path(run_folder)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    data = {**state, "version": CHECKPOINT_VERSION, "updated_at": time.time()}
+
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(run_folder):
+    """Loads the checkpoint of a previous run, raising FileNotFoundError if it has none."""
+    path = checkpoint_path(run_folder)
+    if not path.exists():
+        raise FileNotFoundError(f"No {CHECKPOINT_FILE} in {run_folder}")
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {data.get('version')}")
+    return data
+
+
+async def capture_browser_state(context, page):
+    """Returns the cookies/localStorage and current URL needed to reopen the session."""
+    return {
+        "storage_state": await context.storage_state(),
+        "url": page.url,
+    }
+
+
+def append_step_log(run_folder, index, step, repaired=False, subgoal=None):
+    """
+    Appends one confirmed step to <run_folder>/steps.jsonl. Unlike the
+    checkpoint, the log is never held in memory, so it stays cheap for
+    hierarchical runs with hundreds of steps.
+    """
+    path = Path(run_folder)
+    path.mkdir(exist_ok=True, parents=True)
+    entry = {"index": index + 1, "step": step, "repaired": repaired}
+    if subgoal is not None:
+        entry["subgoal"] = subgoal
+    with open(path / "steps.jsonl", "a") as f:
+        f.write(json.dumps(entry) + "\n")
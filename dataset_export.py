@@ -0,0 +1,496 @@
+import argparse
+import gzip
+import io
+import json
+import mmap
+import os
+import re
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dom_compact import compact_accessibility_tree, compact_semantic_dom, decode_state
+
+
+# ---------------------------------------------
+# DATASET LAYOUT
+#   <out>/manifest.json              shards written so far + the runs they hold
+#   <out>/shard-00000.tar            uncompressed tar, one group of members per step:
+#       <run>/<step>.json            record metadata (task, action, description, ...)
+#       <run>/<step>.png             screenshot (PNG is already compressed)
+#       <run>/<step>.dom.json.gz     semantic DOM (compact form, gzipped)
+#       <run>/<step>.ax.json.gz      accessibility tree (compact form, gzipped)
+#   <out>/shard-00000.index.json     per-record metadata + byte offsets of each member
+#
+# Members are compressed individually and the tar itself is not, so the
+# reader can mmap a shard and slice any member out without scanning it.
+# Member names avoid extra dots so WebDataset-style tools group them by step.
+# ---------------------------------------------
+DATASET_FORMAT = "ui-dataset/1"
+MANIFEST_FILE = "manifest.json"
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+
+STATE_FILE_RE = re.compile(r"^(\d+)_(.*?)(_dom\.json|_accessibility\.json|\.png)$")
+RUN_TASK_RE = re.compile(r"^\d{8}_\d{6}_(.+)$")
+
+
+# ---------------------------------------------
+# RUN DISCOVERY
+# ---------------------------------------------
+def is_run_folder(path):
+    return (path / "screenshots").is_dir() or (path / "dom_states").is_dir()
+
+
+def find_runs(sources, root=None):
+    """
+    Expands each source into (run_id, run folder) pairs: its immediate
+    children that hold screenshots/ or dom_states/, or the source itself when
+    it is a single run folder. A source with run subfolders is never a run
+    itself (agent_outputs/ also has stray top-level screenshots/ and dom_states/).
+    Works for both agent_outputs/<timestamp> and Dataset/<n> layouts.
+
+    Ids come from the run folder's path relative to `root` (default: the
+    working directory), so Dataset/1 is 'Dataset_1' whether it is passed
+    directly or found under Dataset. A run reached through two sources is
+    listed once; two different folders mapping to the same id raise ValueError.
+    """
+    root = Path(root or os.getcwd()).resolve()
+    runs = []
+    seen = {}
+    for source in sources:
+        source = Path(source)
+        if not source.is_dir():
+            continue
+        folders = [p for p in sorted(source.iterdir()) if p.is_dir() and is_run_folder(p)]
+        if not folders and is_run_folder(source):
+            folders = [source]
+        for path in folders:
+            resolved = path.resolve()
+            rid = run_id(resolved, root)
+            if rid in seen:
+                if seen[rid] == resolved:
+                    continue
+                raise ValueError(f"Run id {rid!r} is used by both {seen[rid]} and {resolved}; "
+                                 f"pass a --root that tells them apart")
+            seen[rid] = resolved
+            runs.append((rid, path))
+    return runs
+
+
+def run_id(path, root):
+    """
+    Stable, tar-safe id such as 'Dataset_3' or 'agent_outputs_20251126_142715_create_...'
+    from the resolved run folder `path` relative to `root` (its absolute path if outside).
+    """
+    try:
+        parts = path.relative_to(root).parts
+    except ValueError:
+        parts = path.parts[1:]
+    return re.sub(r"[^A-Za-z0-9_-]", "_", "_".join(parts) or path.name)
+
+
+# ---------------------------------------------
+# RUN METADATA
+# ---------------------------------------------
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_run_metadata(run_dir):
+    """
+    Returns (task, app, actions) for a run folder. Actions are keyed by the
+    1-based step number used in the file names and come from steps.jsonl,
+    falling back to the confirmed steps in checkpoint.json.
+    """
+    run_dir = Path(run_dir)
+    checkpoint = _read_json(run_dir / "checkpoint.json") or {}
+
+    task = checkpoint.get("task")
+    if task is None and (run_dir / "task_description.md").exists():
+        task = (run_dir / "task_description.md").read_text(encoding="utf-8").strip()
+    if task is None:
+        # Older runs only carry the task in their folder name
+        match = RUN_TASK_RE.match(run_dir.name)
+        task = match.group(1).replace("_", " ").strip() if match else None
+
+    actions = {}
+    steps_log = run_dir / "steps.jsonl"
+    if steps_log.exists():
+        with open(steps_log) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                actions[entry["index"]] = entry
+    else:
+        repaired = checkpoint.get("repaired_steps", {})
+        for idx, step in enumerate(checkpoint.get("previous_steps", [])):
+            actions[idx + 1] = {"step": step, "repaired": str(idx) in repaired}
+
+    return task, checkpoint.get("app"), actions
+
+
+def group_step_files(run_dir):
+    """
+    Groups screenshots/*.png and dom_states/*_{dom,accessibility}.json by step
+    number. A repaired step reuses its number with a new description, so each
+    number may have several candidates: {step: {description: {kind: path}}}.
+    """
+    run_dir = Path(run_dir)
+    steps = {}
+    for folder in ("screenshots", "dom_states"):
+        if not (run_dir / folder).is_dir():
+            continue
+        for path in (run_dir / folder).iterdir():
+            match = STATE_FILE_RE.match(path.name)
+            if not match:
+                continue
+            number, description, suffix = match.groups()
+            kind = {".png": "png", "_dom.json": "dom", "_accessibility.json": "ax"}[suffix]
+            steps.setdefault(int(number), {}).setdefault(description, {})[kind] = path
+    return steps
+
+
+def _pick_candidate(candidates, action):
+    """Prefers the files named after the confirmed step, else the newest ones."""
+    if action is not None:
+        description = action["step"].get("description") if isinstance(action.get("step"), dict) else None
+        if description in candidates:
+            return description
+    return max(candidates, key=lambda d: max(p.stat().st_mtime for p in candidates[d].values()))
+
+
+# ---------------------------------------------
+# ENCODING (runs in worker processes)
+# ---------------------------------------------
+def _encode_state(path, kind, compact):
+    data = _read_json(path)
+    if compact and data is not None and not (isinstance(data, dict) and "format" in data):
+        if kind == "dom" and isinstance(data, list):
+            data = compact_semantic_dom(data)
+        elif kind == "ax" and isinstance(data, dict):
+            data = compact_accessibility_tree(data)
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return gzip.compress(raw, compresslevel=6, mtime=0)
+
+
+def encode_run(rid, run_dir, compact=True):
+    """
+    Reads one run folder and returns its step-aligned records as
+    [{"key", "meta", "mtime", "members": [(name, bytes), ...]}], ordered by step.
+    `mtime` is the newest source file's, so re-exports produce identical shards.
+    """
+    run_dir = Path(run_dir)
+    task, app, actions = load_run_metadata(run_dir)
+
+    records = []
+    for number, candidates in sorted(group_step_files(run_dir).items()):
+        action = actions.get(number)
+        description = _pick_candidate(candidates, action)
+        files = candidates[description]
+        key = f"{rid}/{number:04d}"
+
+        meta = {
+            "key": key,
+            "run": rid,
+            "step": number,
+            "task": task,
+            "app": app,
+            "description": description,
+            "action": action["step"] if action else None,
+            "repaired": action.get("repaired", False) if action else None,
+            "subgoal": action.get("subgoal") if action else None,
+            "attempts": len(candidates),
+        }
+        members = [(f"{key}.json", json.dumps(meta, ensure_ascii=False).encode("utf-8"))]
+        if "png" in files:
+            members.append((f"{key}.png", files["png"].read_bytes()))
+        if "dom" in files:
+            members.append((f"{key}.dom.json.gz", _encode_state(files["dom"], "dom", compact)))
+        if "ax" in files:
+            members.append((f"{key}.ax.json.gz", _encode_state(files["ax"], "ax", compact)))
+        mtime = int(max(path.stat().st_mtime for path in files.values()))
+        records.append({"key": key, "meta": meta, "mtime": mtime, "members": members})
+    return rid, records
+
+
+# ---------------------------------------------
+# SHARD WRITING (parent process)
+# ---------------------------------------------
+def _write_json_atomic(path, data):
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ShardWriter:
+    """
+    Streams records into shard-NNNNN.tar files, rolling over at `shard_size`
+    bytes. A shard only counts as written once its index and the dataset
+    manifest are saved, so an interrupted export resumes at the first run
+    that is not in a finished shard.
+    """
+
+    def __init__(self, out_dir, shard_size=DEFAULT_SHARD_SIZE):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(exist_ok=True, parents=True)
+        self.shard_size = shard_size
+        self.manifest = load_manifest(self.out_dir)
+        self._tar = None
+        self._name = None
+        self._runs = []
+        self._records = []
+
+    def done_runs(self):
+        return {rid for shard in self.manifest["shards"] for rid in shard["runs"]}
+
+    def _open(self):
+        number = len(self.manifest["shards"])
+        self._name = f"shard-{number:05d}.tar"
+        # Plain tar (no stream compression) keeps member offsets stable for mmap
+        self._tar = tarfile.open(self.out_dir / f"{self._name}.tmp", "w", format=tarfile.PAX_FORMAT)
+        self._runs = []
+        self._records = []
+
+    def add_run(self, rid, records):
+        # Runs are never split across shards, so resume is per run
+        if self._tar is None:
+            self._open()
+        for record in records:
+            for name, data in record["members"]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = record["mtime"]
+                self._tar.addfile(info, io.BytesIO(data))
+            self._records.append(record["meta"])
+        self._runs.append(rid)
+        if self._tar.offset >= self.shard_size:
+            self.close_shard()
+
+    def close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        tmp_path = self.out_dir / f"{self._name}.tmp"
+        tar_path = self.out_dir / self._name
+        os.replace(tmp_path, tar_path)
+
+        # Offsets are read back from the finished tar (headers only)
+        members = {}
+        with tarfile.open(tar_path, "r") as tar:
+            for info in tar:
+                # Keys contain no dots, so everything after the first one is the member type
+                key, _, member = info.name.partition(".")
+                members.setdefault(key, {})[member] = [info.offset_data, info.size]
+
+        index_name = self._name.replace(".tar", ".index.json")
+        records = [{**meta, "members": members.get(meta["key"], {})} for meta in self._records]
+        _write_json_atomic(self.out_dir / index_name, {"format": DATASET_FORMAT, "records": records})
+
+        self.manifest["shards"].append({
+            "name": self._name,
+            "index": index_name,
+            "runs": self._runs,
+            "records": len(records),
+            "bytes": tar_path.stat().st_size,
+        })
+        _write_json_atomic(self.out_dir / MANIFEST_FILE, self.manifest)
+        print(f"[EXPORT] wrote {self._name}: {len(self._runs)} runs, {len(records)} records")
+        self._tar = None
+
+
+def load_manifest(out_dir):
+    manifest = _read_json(Path(out_dir) / MANIFEST_FILE)
+    if manifest is None:
+        return {"format": DATASET_FORMAT, "shards": []}
+    if manifest.get("format") != DATASET_FORMAT:
+        raise ValueError(f"Unsupported dataset format: {manifest.get('format')}")
+    return manifest
+
+
+def export_runs(sources, out_dir, shard_size=DEFAULT_SHARD_SIZE, workers=None, compact=True, root=None):
+    """
+    Packs every run folder under `sources` into shards in `out_dir`, with run
+    ids relative to `root` (see find_runs). The root is saved in the manifest
+    and reused on resume, so a run keeps its id and is not exported twice.
+    Runs are encoded (read, compacted, gzipped) in parallel worker processes
+    and written by this process in run order; at most 2 * workers encoded
+    runs are held in memory at once. Runs already in the manifest are skipped.
+    """
+    writer = ShardWriter(out_dir, shard_size=shard_size)
+    saved_root = writer.manifest.get("root")
+    root = str(Path(root or saved_root or os.getcwd()).resolve())
+    if saved_root is not None and root != saved_root:
+        raise ValueError(f"{out_dir} was exported with --root {saved_root}; resume with the same root")
+    writer.manifest["root"] = root
+    done = writer.done_runs()
+    pending = [(rid, run) for rid, run in find_runs(sources, root=root) if rid not in done]
+    print(f"[EXPORT] {len(pending)} runs to export ({len(done)} already exported)")
+    if not pending:
+        return writer.manifest
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(encode_run, rid, run, compact) for rid, run in pending[:2 * workers]]
+        next_run = len(futures)
+        while futures:
+            rid, records = futures.pop(0).result()
+            writer.add_run(rid, records)
+            if next_run < len(pending):
+                futures.append(pool.submit(encode_run, *pending[next_run], compact))
+                next_run += 1
+    writer.close_shard()
+    return writer.manifest
+
+
+# ---------------------------------------------
+# LAZY MEMORY-MAPPED READER
+# ---------------------------------------------
+class StepRecord:
+    """
+    One exported step. Metadata is available immediately; screenshot, dom and
+    accessibility are sliced out of the mmapped shard only when accessed.
+    """
+
+    def __init__(self, reader, shard, entry):
+        self._reader = reader
+        self._shard = shard
+        self._entry = entry
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self._entry[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def has(self, member):
+        return member in self._entry["members"]
+
+    def _member(self, member):
+        if member not in self._entry["members"]:
+            return None
+        offset, size = self._entry["members"][member]
+        return self._reader._map(self._shard)[offset:offset + size]
+
+    @property
+    def screenshot(self):
+        """PNG bytes, or None if the step has no screenshot."""
+        return self._member("png")
+
+    def _state(self, member):
+        data = self._member(member)
+        return None if data is None else decode_state(json.loads(gzip.decompress(data)))
+
+    @property
+    def dom(self):
+        """Semantic DOM in its original (expanded) shape."""
+        return self._state("dom.json.gz")
+
+    @property
+    def accessibility(self):
+        """Accessibility tree in its original (expanded) shape."""
+        return self._state("ax.json.gz")
+
+    def __repr__(self):
+        return f"StepRecord({self._entry['key']!r})"
+
+
+class DatasetReader:
+    """
+    Random access over an exported dataset. Only the shard indexes are read
+    up front; shards are mmapped on first access and shared by all records.
+
+        with DatasetReader("datasets/v1") as ds:
+            for record in ds:
+                record.task, record.action, record.screenshot, record.dom
+    """
+
+    def __init__(self, dataset_dir):
+        self.dataset_dir = Path(dataset_dir)
+        self.manifest = load_manifest(self.dataset_dir)
+        self._maps = {}
+        self._files = {}
+        self._records = []
+        for shard in self.manifest["shards"]:
+            index = _read_json(self.dataset_dir / shard["index"])
+            if index is None:
+                raise FileNotFoundError(f"Missing or unreadable index {shard['index']}")
+            self._records.extend((shard["name"], entry) for entry in index["records"])
+
+    def _map(self, shard):
+        mapped = self._maps.get(shard)
+        if mapped is None:
+            f = open(self.dataset_dir / shard, "rb")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._files[shard] = f
+            self._maps[shard] = mapped
+        return mapped
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, i):
+        shard, entry = self._records[i]
+        return StepRecord(self, shard, entry)
+
+    def __iter__(self):
+        for i in range(len(self._records)):
+            yield self[i]
+
+    def runs(self):
+        """Run ids in export order."""
+        return list(dict.fromkeys(entry["run"] for _, entry in self._records))
+
+    def run(self, rid):
+        """All records of one run, ordered by step."""
+        return [StepRecord(self, shard, entry) for shard, entry in self._records if entry["run"] == rid]
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        for f in self._files.values():
+            f.close()
+        self._maps.clear()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack run folders into a sharded dataset")
+    parser.add_argument("sources", nargs="+",
+                        help="Run folders or folders containing them (e.g. agent_outputs Dataset)")
+    parser.add_argument("--out", required=True, help="Dataset directory (re-run to resume)")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE // (1024 * 1024),
+                        help="Target shard size in MB (default 256)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Encoding processes (default: CPU count)")
+    parser.add_argument("--root", default=None,
+                        help="Run ids are run folder paths relative to this directory "
+                             "(default: the root of a resumed export, else the current directory)")
+    parser.add_argument("--no-compact", action="store_true",
+                        help="Store DOM/AX JSON as-is instead of the compact interned form")
+    args = parser.parse_args()
+
+    manifest = export_runs(args.sources, args.out, shard_size=args.shard_size * 1024 * 1024,
+                           workers=args.workers, compact=not args.no_compact, root=args.root)
+    records = sum(shard["records"] for shard in manifest["shards"])
+    print(f"[EXPORT] {args.out}: {len(manifest['shards'])} shards, {records} records")
+
+
+if __name__ == "__main__":
+    main()
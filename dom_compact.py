@@ -0,0 +1,305 @@
+import json
+
+
+AX_FORMAT = "ax-compact/1"
+DOM_FORMAT = "dom-compact/1"
+
+
+class StringTable:
+    """
+    Interns strings into a single table so repeated roles, tags, names and
+    attribute keys are stored once and referenced by index.
+    """
+
+    def __init__(self, strings=None):
+        self.strings = list(strings or [])
+        self._index = {s: i for i, s in enumerate(self.strings)}
+
+    def intern(self, s):
+        idx = self._index.get(s)
+        if idx is None:
+            idx = len(self.strings)
+            self.strings.append(s)
+            self._index[s] = idx
+        return idx
+
+
+# ---------------------------------------------
+# VALUE ENCODING
+#   str          -> index into the string table
+#   bool / None  -> stored as-is
+#   anything else (numbers, lists, dicts) -> wrapped in a 1-element list
+# ---------------------------------------------
+def _encode_value(table, value):
+    if isinstance(value, str):
+        return table.intern(value)
+    if value is None or isinstance(value, bool):
+        return value
+    return [value]
+
+
+def _decode_value(strings, value):
+    if type(value) is int:
+        return strings[value]
+    if isinstance(value, list):
+        return value[0]
+    return value
+
+
+def _encode_pairs(table, node, skip=(), omit_none=False):
+    pairs = []
+    for key, value in node.items():
+        if key in skip or (omit_none and value is None):
+            continue
+        pairs.append(table.intern(key))
+        pairs.append(_encode_value(table, value))
+    return pairs
+
+
+def _decode_pairs(strings, pairs, into):
+    for i in range(0, len(pairs), 2):
+        into[strings[pairs[i]]] = _decode_value(strings, pairs[i + 1])
+    return into
+
+
+# ---------------------------------------------
+# ACCESSIBILITY TREE
+# ---------------------------------------------
+def compact_accessibility_tree(tree):
+    """
+    Flattens a page.accessibility.snapshot() tree into pre-order node tables.
+
+    Every node gets a parent index (-1 for the root), interned role and name
+    columns, and a sparse list of its remaining properties.
+    Returns None when the snapshot itself was None.
+    """
+    if tree is None:
+        return None
+
+    table = StringTable()
+    parent, roles, names, props = [], [], [], {}
+
+    stack = [(tree, -1)]
+    while stack:
+        node, parent_idx = stack.pop()
+        idx = len(parent)
+        parent.append(parent_idx)
+        roles.append(table.intern(node["role"]) if "role" in node else -1)
+        names.append(table.intern(node["name"]) if "name" in node else -1)
+
+        pairs = _encode_pairs(table, node, skip=("role", "name", "children"))
+        if pairs:
+            props[str(idx)] = pairs
+
+        children = node.get("children")
+        if children is not None:
+            if not children:
+                # Keep an explicit empty children list distinguishable from a missing one
+                props.setdefault(str(idx), []).extend([table.intern("children"), [[]]])
+            for child in reversed(children):
+                stack.append((child, idx))
+
+    return {
+        "format": AX_FORMAT,
+        "strings": table.strings,
+        "parent": parent,
+        "role": roles,
+        "name": names,
+        "props": props,
+    }
+
+
+def expand_accessibility_tree(compact):
+    """
+    Rebuilds the nested snapshot dict produced by Playwright from its compact form.
+    """
+    if compact is None:
+        return None
+
+    strings = compact["strings"]
+    props = compact["props"]
+    nodes = []
+
+    for idx, parent_idx in enumerate(compact["parent"]):
+        node = {}
+        if compact["role"][idx] >= 0:
+            node["role"] = strings[compact["role"][idx]]
+        if compact["name"][idx] >= 0:
+            node["name"] = strings[compact["name"][idx]]
+        pairs = props.get(str(idx))
+        if pairs:
+            _decode_pairs(strings, pairs, node)
+        nodes.append(node)
+
+        if parent_idx >= 0:
+            nodes[parent_idx].setdefault("children", []).append(node)
+
+    return nodes[0] if nodes else None
+
+
+def render_accessibility_tree(compact, max_nodes=None):
+    """
+    Renders the compact AX tree as indented text lines for LLM prompts:
+        role "name" key=value ...
+    """
+    if compact is None:
+        return "(no accessibility tree)"
+
+    strings = compact["strings"]
+    parent = compact["parent"]
+    depth = []
+    lines = []
+
+    for idx, parent_idx in enumerate(parent):
+        depth.append(depth[parent_idx] + 1 if parent_idx >= 0 else 0)
+        if max_nodes is not None and idx >= max_nodes:
+            lines.append(f"... ({len(parent) - idx} more nodes)")
+            break
+
+        parts = []
+        if compact["role"][idx] >= 0:
+            parts.append(strings[compact["role"][idx]])
+        if compact["name"][idx] >= 0 and strings[compact["name"][idx]]:
+            parts.append(json.dumps(strings[compact["name"][idx]], ensure_ascii=False))
+
+        props = _decode_pairs(strings, compact["props"].get(str(idx), []), {})
+        props.pop("children", None)
+        for key, value in props.items():
+            parts.append(f"{key}={_render_scalar(value)}")
+
+        lines.append("  " * depth[idx] + " ".join(parts))
+
+    return "\n".join(lines)
+
+
+# ---------------------------------------------
+# SEMANTIC DOM
+# ---------------------------------------------
+def compact_semantic_dom(nodes):
+    """
+    Converts the semantic DOM (a list of flat dicts) into interned rows.
+
+    Each row is a flat [key, value, key, value, ...] list with null fields
+    omitted. `columns` records every key in first-seen order, and `nulls`
+    (sparse, keyed by str(row)) lists the column indexes a row had as null,
+    so rows with different keys round-trip exactly.
+    """
+    if nodes is None:
+        return None
+
+    table = StringTable()
+    columns = {}
+    rows = []
+    nulls = {}
+
+    for idx, node in enumerate(nodes):
+        for key, value in node.items():
+            col = columns.setdefault(key, len(columns))
+            if value is None:
+                nulls.setdefault(str(idx), []).append(col)
+        rows.append(_encode_pairs(table, node, omit_none=True))
+
+    return {
+        "format": DOM_FORMAT,
+        "strings": table.strings,
+        "columns": list(columns),
+        "rows": rows,
+        "nulls": nulls,
+    }
+
+
+def expand_semantic_dom(compact):
+    """
+    Rebuilds the list-of-dicts semantic DOM, restoring omitted null fields.
+    """
+    if compact is None:
+        return None
+
+    strings = compact["strings"]
+    columns = compact["columns"]
+    nulls = compact.get("nulls")
+    nodes = []
+    for idx, pairs in enumerate(compact["rows"]):
+        if nulls is None:
+            # Files written before `nulls` existed: every row had every column
+            nodes.append(_decode_pairs(strings, pairs, dict.fromkeys(columns)))
+            continue
+        values = _decode_pairs(strings, pairs, {})
+        null_keys = {columns[col] for col in nulls.get(str(idx), ())}
+        nodes.append({key: values.get(key) for key in columns if key in values or key in null_keys})
+    return nodes
+
+
+def render_semantic_dom(compact, max_nodes=None, max_text=80):
+    """
+    Renders the compact semantic DOM as one line per element for LLM prompts:
+        [i] tag role "text" aria="..." ... selector=...
+    """
+    if compact is None:
+        return "(no semantic dom)"
+
+    strings = compact["strings"]
+    rows = compact["rows"]
+    lines = []
+
+    for idx, pairs in enumerate(rows):
+        if max_nodes is not None and idx >= max_nodes:
+            lines.append(f"... ({len(rows) - idx} more elements)")
+            break
+
+        node = _decode_pairs(strings, pairs, {})
+        parts = [f"[{idx}]", node.pop("tag", "?")]
+        role = node.pop("role", None)
+        if role:
+            parts.append(role)
+        text = node.pop("text", None)
+        if text:
+            text = " ".join(text.split())[:max_text]
+            parts.append(json.dumps(text, ensure_ascii=False))
+        selector = node.pop("selector", None)
+        for key, value in node.items():
+            if value == "" or value is None:
+                continue
+            parts.append(f"{key}={_render_scalar(value)}")
+        if selector:
+            parts.append(f"selector={selector}")
+
+        lines.append(" ".join(parts))
+
+    return "\n".join(lines)
+
+
+def _render_scalar(value):
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return json.dumps(value, separators=(",", ":"))
+
+
+# ---------------------------------------------
+# FILE HELPERS
+# ---------------------------------------------
+def dump_compact(compact, path):
+    """Writes a compact structure without indentation or extra whitespace."""
+    with open(path, "w") as f:
+        json.dump(compact, f, separators=(",", ":"), ensure_ascii=False)
+
+
+def load_state_file(path):
+    """
+    Loads a saved *_dom.json / *_accessibility.json file and always returns the
+    original JSON shape, whether it was written in full or compact form.
+    """
+    with open(path) as f:
+        return decode_state(json.load(f))
+
+
+def decode_state(data):
+    """Expands already-parsed state JSON if it is in compact form."""
+    if isinstance(data, dict):
+        if data.get("format") == AX_FORMAT:
+            return expand_accessibility_tree(data)
+        if data.get("format") == DOM_FORMAT:
+            return expand_semantic_dom(data)
+    return data
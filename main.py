@@ -1,116 +1,424 @@
-from agents import generate_plan, repair_step
+from agents import (
+    generate_plan,
+    repair_step,
+    decompose_task,
+    plan_subgoal,
+    RollingHistory,
+    UsageTracker,
+    BudgetExceededError,
+    LLMCallError,
+    Router,
+    routing_enabled,
+    app_seen_before,
+)
 import os
 import json
 from playwright_executor import StepExecutor
+from agents.validation import is_valid_step, is_valid_subgoals_response, is_valid_subgoal_plan_response
+from checkpoint import save_checkpoint, load_checkpoint, capture_browser_state, append_step_log
+from network_rules import NetworkRouter, prepare_context
+from dom_compact import (
+    compact_semantic_dom,
+    compact_accessibility_tree,
+    render_semantic_dom,
+    render_accessibility_tree,
+)
+import argparse
 import asyncio
 import datetime
 import re
 from dotenv import load_dotenv
 
 load_dotenv()
+
+# Caps on the page state embedded in hierarchical planning/repair prompts,
+# so prompt size stays constant on huge pages and long workflows
+HIERARCHICAL_DOM_NODES = 400
+HIERARCHICAL_AX_NODES = 600
+# Longest plan accepted for a single subgoal (extra steps are dropped)
+SUBGOAL_MAX_STEPS = 12
+
 def main():
+    parser = argparse.ArgumentParser(description="Universal UI Workflow Agent")
+    parser.add_argument("--resume", metavar="RUN_FOLDER",
+                        help="Continue an interrupted run from its last confirmed step")
+    parser.add_argument("--network", choices=["live", "record", "replay"], default="live",
+                        help="live: network + routing rules; record: also save a HAR in the run folder; "
+                             "replay: serve responses from --har without touching the network")
+    parser.add_argument("--har", metavar="HAR_FILE",
+                        help="HAR file to replay (e.g. agent_outputs/<run>/network.har)")
+    parser.add_argument("--no-network-rules", action="store_true",
+                        help="Do not apply the per-app block/stub/cache rules")
+    parser.add_argument("--planning", choices=["flat", "hierarchical"], default="flat",
+                        help="flat: plan every step up front; hierarchical: split into subgoals "
+                             "and plan each one from the current page with a bounded history")
+    args = parser.parse_args()
+    if args.network == "replay" and not args.har:
+        parser.error("--network replay requires --har")
+
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("Error: OPENAI_API_KEY is not set in the environment variables.")
         return
 
-    # Ask user which app to automate
-    app_choice = input("Which app do you want to automate? (notion/linear): ").strip().lower()
-    if app_choice == "linear":
-        storage_state_file = "saved_cookies/linear_state.json"
+    if args.resume:
+        # ---------------------------------------------
+        # Resume from checkpoint (no re-planning)
+        # ---------------------------------------------
+        try:
+            checkpoint = load_checkpoint(args.resume)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Cannot resume: {e}")
+            return
+        if checkpoint.get("completed"):
+            print(f"Run in '{args.resume}' already completed.")
+            return
+
+        run_folder = args.resume
+        user_input = checkpoint["task"]
+        app_choice = checkpoint.get("app")
+        storage_state_file = checkpoint["storage_state_file"]
+        planning = checkpoint.get("planning", "flat")
+        if planning == "hierarchical":
+            hierarchy = checkpoint["hierarchy"]
+            history = RollingHistory.from_dict(hierarchy.pop("history"))
+            steps, previous_steps, repaired_steps = [], [], {}
+            start_index = hierarchy["step_counter"]
+            print(f"Resuming '{run_folder}' at subgoal "
+                  f"{hierarchy['subgoal_index'] + 1}/{len(hierarchy['subgoals'])}")
+        else:
+            hierarchy = history = None
+            steps = checkpoint["steps"]
+            previous_steps = checkpoint["previous_steps"]
+            repaired_steps = checkpoint.get("repaired_steps", {})
+            start_index = checkpoint["next_index"]
+            print(f"Resuming '{run_folder}' at step {start_index + 1}/{len(steps)}")
+        tracker = UsageTracker.from_env(run_folder)
+        # LLM_ROUTING=1 picks planner/repair models by difficulty and live stats
+        router = Router.from_env() if routing_enabled() else None
+        app_seen = router is None or app_seen_before(app_choice)
     else:
-        storage_state_file = "saved_cookies/notion_state.json"
+        # Ask user which app to automate
+        app_choice = input("Which app do you want to automate? (notion/linear): ").strip().lower()
+        if app_choice == "linear":
+            storage_state_file = "saved_cookies/linear_state.json"
+        else:
+            app_choice = "notion"
+            storage_state_file = "saved_cookies/notion_state.json"
 
-    # Getting user input for task description
-    user_input = input("Enter NLP query from agent A:")
+        # Getting user input for task description
+        user_input = input("Enter NLP query from agent A:")
 
-    # ---------------------------------------------
-    # Plan - A
-    # ---------------------------------------------
+        # Create a unique folder name for each run
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Use a sanitized version of the task description for folder name
+        #task_name = re.sub(r'[^a-zA-Z0-9_-]', '_', user_input)[:40]
+        run_folder = f"agent_outputs/{timestamp}"
 
-    print("Calling o3-mini with Plan A...")
-    response_A = generate_plan(user_input, api_key)
-    print("Got response from o3-mini")
-    print(response_A)
+        # Token/cost accounting for every LLM call of this run (usage.jsonl in run_folder)
+        tracker = UsageTracker.from_env(run_folder)
+        # LLM_ROUTING=1 picks planner/repair models by difficulty and live stats
+        router = Router.from_env() if routing_enabled() else None
+        app_seen = router is None or app_seen_before(app_choice)
+        planning = args.planning
 
-    try:
-        steps = json.loads(response_A)
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse JSON from o3-mini response: {e}")
-        return
+        if planning == "hierarchical":
+            # ---------------------------------------------
+            # Plan - C (split into subgoals; steps are planned just in time)
+            # ---------------------------------------------
+            print("Calling o3-mini with Plan C (subgoal decomposition)...")
+            try:
+                response_C = decompose_task(user_input, api_key, tracker=tracker, router=router,
+                                            app_seen=app_seen)
+            except (BudgetExceededError, LLMCallError) as e:
+                print(f"Aborting: {e}")
+                return
+            print(response_C)
+
+            if not is_valid_subgoals_response(response_C):
+                print("Plan C did not return a JSON array of {goal, done_when} subgoals.")
+                return
+            subgoals = json.loads(response_C)
+
+            hierarchy = {
+                "subgoals": subgoals,
+                "subgoal_index": 0,
+                # Steps of the current subgoal (None until it is planned)
+                "subgoal_steps": None,
+                "subgoal_step_index": 0,
+                # Global step number, used for output file names
+                "step_counter": 0,
+            }
+            history = RollingHistory()
+            steps = []
+        else:
+            hierarchy = history = None
+            # ---------------------------------------------
+            # Plan - A
+            # ---------------------------------------------
+
+            print("Calling o3-mini with Plan A...")
+            try:
+                response_A = generate_plan(user_input, api_key, tracker=tracker, router=router,
+                                           app_seen=app_seen)
+            except (BudgetExceededError, LLMCallError) as e:
+                print(f"Aborting: {e}")
+                return
+            print("Got response from o3-mini")
+            print(response_A)
+
+            try:
+                steps = json.loads(response_A)
+            except json.JSONDecodeError as e:
+                print(f"Failed to parse JSON from o3-mini response: {e}")
+                return
+
+        previous_steps = []
+        # Steps replaced by Plan B, keyed by step index (str for JSON)
+        repaired_steps = {}
+        start_index = 0
+        checkpoint = None
+
+    compact_states = os.getenv("COMPACT_STATES", "0") == "1"
+    # SNAPSHOT_EXTRACTOR=cdp switches to the single-pass CDP extractor (cdp_snapshot.py)
+    extractor = os.getenv("SNAPSHOT_EXTRACTOR", "evaluate")
+    executor = StepExecutor(steps=steps, output_dir=run_folder,
+                            compact_states=compact_states, extractor=extractor)
+
+    async def write_checkpoint(context, page, next_index=None, completed=False):
+        # Written only after a step is confirmed, so resuming never repeats its side effects
+        state = {
+            "task": user_input,
+            "app": app_choice,
+            "storage_state_file": storage_state_file,
+            "planning": planning,
+            "completed": completed,
+            **await capture_browser_state(context, page),
+        }
+        if planning == "hierarchical":
+            state["hierarchy"] = {**hierarchy, "history": history.to_dict()}
+        else:
+            state.update({
+                "steps": steps,
+                "previous_steps": previous_steps,
+                "repaired_steps": repaired_steps,
+                "next_index": next_index,
+            })
+        save_checkpoint(run_folder, state)
+
+    # Per-app request routing (network_rules.py) and optional HAR record/replay
+    network_router = None if args.no_network_rules else NetworkRouter.for_app(app_choice)
+    if args.network == "record":
+        har_name = "network.har" if start_index == 0 else f"network_resume_{start_index + 1}.har"
+        har_path = os.path.join(run_folder, har_name)
+    else:
+        har_path = args.har
+
+    async def run_step(page, idx, step):
+        # A malformed step (not an object, unknown action, missing selector/value)
+        # fails like any other step, so Plan B can replace it
+        if not is_valid_step(step):
+            semantic_dom, accessibility_tree = await executor._extract_ui_state(page)
+            return False, f"Unknown action or missing field in step: {json.dumps(step)}", semantic_dom, accessibility_tree
+        return await executor.execute_step(page, idx, step)
+
+    async def execute_with_repair(page, idx, step, history_text, max_dom_nodes=None, max_ax_nodes=None):
+        """
+        Executes one step and, if it fails, repairs it with Plan B (escalating
+        model tiers when a router is active). Returns the step that finally
+        succeeded, or None if the run must abort.
+        """
+        print(f"\n\n Executing step: {step}")
+        success, error_message, semantic_dom, accessibility_tree = await run_step(page, idx, step)
+        if success:
+            print("Step executed successfully.")
+            return step
 
-    
-    # Create a unique folder name for each run
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    # Use a sanitized version of the task description for folder name
-    #task_name = re.sub(r'[^a-zA-Z0-9_-]', '_', user_input)[:40]
-    run_folder = f"agent_outputs/{timestamp}"
-    executor = StepExecutor(steps=steps, output_dir=run_folder)
-    previous_steps = []
+        # ---------------------------------------------
+        # Plan - B
+        # ---------------------------------------------
+        print(f"Step failed with error: {error_message}")
+        print("Calling o3-mini with Plan B...")
+        # # ---------------------------------------------
+        # # AUTO-SCROLL + AUTO-EXPAND BEFORE PLAN B
+        # # ---------------------------------------------
+        # try:
+        #     await page.mouse.wheel(0, 4000)
+        #     await page.wait_for_timeout(200)
+        #     await executor.auto_expand_ui(page)
+        # except:
+        #     pass
+
+        # Refresh DOM for repair prompt
+        semantic_dom, accessibility_tree = await executor._extract_ui_state(page)
+
+        # With a router, a repaired step that fails execution is
+        # repaired again by the next stronger model tier
+        min_tier = 0
+        while True:
+            # Use repair_step from agents
+            try:
+                response_B = repair_step(
+                    user_input,
+                    history_text,
+                    json.dumps(step, indent=2),
+                    error_message,
+                    render_semantic_dom(compact_semantic_dom(semantic_dom), max_nodes=max_dom_nodes),
+                    render_accessibility_tree(compact_accessibility_tree(accessibility_tree), max_nodes=max_ax_nodes),
+                    api_key,
+                    tracker=tracker,
+                    step_index=idx,
+                    router=router,
+                    min_tier=min_tier
+                )
+            except (BudgetExceededError, LLMCallError) as e:
+                print(f"Aborting: {e}")
+                print(f"Resume later with: python main.py --resume {run_folder}")
+                return None
+            print("Got response from o3-mini")
+            try:
+                repaired_step = json.loads(response_B)
+            except json.JSONDecodeError as e:
+                print(f"Failed to parse JSON from o3-mini response: {e}")
+                print("Aborting further execution.")
+                print(f"Resume later with: python main.py --resume {run_folder}")
+                return None
+
+            print(f"Repaired step: {repaired_step}")
+            success, error_message, semantic_dom, accessibility_tree = await run_step(page, idx, repaired_step)
+            if router is not None:
+                router.record_outcome(success)
+            if success:
+                print("Repaired step executed successfully.")
+                return repaired_step
+            print(f"Repaired step failed again with error: {error_message}")
+            if router is not None and router.can_escalate():
+                min_tier = router.next_tier()
+                print(f"Escalating repair to {router.tiers[min_tier]}...")
+                continue
+            print("Aborting further execution.")
+            print(f"Resume later with: python main.py --resume {run_folder}")
+            return None
+
+    async def run_flat(context, page):
+        for idx in range(start_index, len(steps)):
+            step = steps[idx]
+            done_step = await execute_with_repair(page, idx, step, json.dumps(previous_steps, indent=2))
+            if done_step is None:
+                return False
+            previous_steps.append(done_step)
+            if done_step is not step:
+                repaired_steps[str(idx)] = done_step
+            append_step_log(run_folder, idx, done_step, repaired=done_step is not step)
+            await write_checkpoint(context, page, idx + 1)
+        return True
+
+    async def run_hierarchical(context, page):
+        subgoals = hierarchy["subgoals"]
+        while hierarchy["subgoal_index"] < len(subgoals):
+            subgoal = subgoals[hierarchy["subgoal_index"]]
+
+            if hierarchy["subgoal_steps"] is None:
+                # ---------------------------------------------
+                # Plan - D (steps for this subgoal, from the current page)
+                # ---------------------------------------------
+                print(f"\n=== Subgoal {hierarchy['subgoal_index'] + 1}/{len(subgoals)}: {subgoal['goal']}")
+                semantic_dom, accessibility_tree = await executor._extract_ui_state(page)
+                try:
+                    response_D = plan_subgoal(
+                        user_input,
+                        subgoal,
+                        history.render(),
+                        page.url,
+                        render_semantic_dom(compact_semantic_dom(semantic_dom), max_nodes=HIERARCHICAL_DOM_NODES),
+                        render_accessibility_tree(compact_accessibility_tree(accessibility_tree), max_nodes=HIERARCHICAL_AX_NODES),
+                        api_key,
+                        tracker=tracker,
+                        router=router,
+                        step_index=hierarchy["step_counter"],
+                        max_steps=SUBGOAL_MAX_STEPS,
+                        app_seen=app_seen
+                    )
+                except (BudgetExceededError, LLMCallError) as e:
+                    print(f"Aborting: {e}")
+                    print(f"Resume later with: python main.py --resume {run_folder}")
+                    return False
+                try:
+                    subgoal_steps = json.loads(response_D)
+                except json.JSONDecodeError as e:
+                    print(f"Failed to parse JSON from o3-mini response: {e}")
+                    print(f"Resume later with: python main.py --resume {run_folder}")
+                    return False
+                if not isinstance(subgoal_steps, list):
+                    print("Plan D did not return a JSON array of steps.")
+                    print(f"Resume later with: python main.py --resume {run_folder}")
+                    return False
+                if not is_valid_subgoal_plan_response(response_D):
+                    invalid = sum(not is_valid_step(s) for s in subgoal_steps)
+                    print(f"Plan D returned {invalid} invalid step(s); they will be repaired with Plan B")
+                if len(subgoal_steps) > SUBGOAL_MAX_STEPS:
+                    print(f"Plan D returned {len(subgoal_steps)} steps, keeping the first {SUBGOAL_MAX_STEPS}")
+                hierarchy["subgoal_steps"] = subgoal_steps[:SUBGOAL_MAX_STEPS]
+                hierarchy["subgoal_step_index"] = 0
+                await write_checkpoint(context, page)
+
+            subgoal_steps = hierarchy["subgoal_steps"]
+            while hierarchy["subgoal_step_index"] < len(subgoal_steps):
+                step = subgoal_steps[hierarchy["subgoal_step_index"]]
+                idx = hierarchy["step_counter"]
+                done_step = await execute_with_repair(page, idx, step, history.render(),
+                                                      HIERARCHICAL_DOM_NODES, HIERARCHICAL_AX_NODES)
+                if done_step is None:
+                    return False
+                history.add_step(done_step, repaired=done_step is not step, url=page.url)
+                append_step_log(run_folder, idx, done_step, repaired=done_step is not step, subgoal=subgoal["goal"])
+                hierarchy["subgoal_step_index"] += 1
+                hierarchy["step_counter"] += 1
+                await write_checkpoint(context, page)
+
+            history.complete_subgoal(subgoal["goal"])
+            hierarchy["subgoal_index"] += 1
+            hierarchy["subgoal_steps"] = None
+            await write_checkpoint(context, page)
+        return True
 
     async def run_steps():
         from playwright.async_api import async_playwright
         async with async_playwright() as p:
             browser = await p.chromium.launch(headless=False)
-            context = await browser.new_context(storage_state=storage_state_file)
-            page = await context.new_page()
-
-            task_failed = False
-            for idx, step in enumerate(steps):
-                print(f"\n\n Executing step: {step}")
-                success, error_message, semantic_dom, accessibility_tree = await executor.execute_step(page, idx, step)
-                if success:
-                    print("Step executed successfully.")
-                    previous_steps.append(step)
-                else:
-                    # ---------------------------------------------
-                    # Plan - B
-                    # ---------------------------------------------
-                    print(f"Step failed with error: {error_message}")
-                    print("Calling o3-mini with Plan B...")
-                    # # ---------------------------------------------
-                    # # AUTO-SCROLL + AUTO-EXPAND BEFORE PLAN B
-                    # # ---------------------------------------------
-                    # try:
-                    #     await page.mouse.wheel(0, 4000)
-                    #     await page.wait_for_timeout(200)
-                    #     await executor.auto_expand_ui(page)
-                    # except:
-                    #     pass
-
-                    # Refresh DOM for repair prompt
-                    semantic_dom = await executor._extract_semantic_dom(page)
-                    accessibility_tree = await executor._extract_accessibility_tree(page)
-
-                    # Use repair_step from agents
-                    response_B = repair_step(
-                        user_input,
-                        json.dumps(previous_steps, indent=2),
-                        json.dumps(step, indent=2),
-                        error_message,
-                        json.dumps(semantic_dom, indent=2),
-                        json.dumps(accessibility_tree, indent=2),
-                        api_key
-                    )
-                    print("Got response from o3-mini")
-                    try:
-                        repaired_step = json.loads(response_B)
-                        print(f"Repaired step: {repaired_step}")
-                        success, error_message, _, _ = await executor.execute_step(page, idx, repaired_step)
-                        if success:
-                            print("Repaired step executed successfully.")
-                            previous_steps.append(repaired_step)
-                        else:
-                            print(f"Repaired step failed again with error: {error_message}")
-                            print("Aborting further execution.")
-                            break
-                    except json.JSONDecodeError as e:
-                        print(f"Failed to parse JSON from o3-mini response: {e}")
-                        print("Aborting further execution.")
-                        break
+            if checkpoint is not None:
+                # Restore the session exactly as it was after the last confirmed step
+                context = await browser.new_context(storage_state=checkpoint["storage_state"])
+                await prepare_context(context, network_router, mode=args.network, har_path=har_path)
+                page = await context.new_page()
+                if checkpoint.get("url") and checkpoint["url"] != "about:blank":
+                    await page.goto(checkpoint["url"], wait_until="domcontentloaded")
+            else:
+                context = await browser.new_context(storage_state=storage_state_file)
+                await prepare_context(context, network_router, mode=args.network, har_path=har_path)
+                page = await context.new_page()
+                # Persist the plan up front so even a crash in step 1 resumes without re-planning
+                await write_checkpoint(context, page, start_index)
+
+            if planning == "hierarchical":
+                task_failed = not await run_hierarchical(context, page)
+            else:
+                task_failed = not await run_flat(context, page)
+
+            if not task_failed:
+                await write_checkpoint(context, page, len(steps), completed=True)
+            # Closing the context explicitly flushes the recorded HAR
+            await context.close()
+            if network_router is not None:
+                network_router.save_stats(run_folder)
+            if args.network == "record":
+                print(f"Recorded network traffic to '{har_path}'")
             await browser.close()
             if not task_failed:
                 print(f"✅ Task completed and outputs stored in '{run_folder}'")
+            usage = tracker.summary()
+            print(f"LLM usage: {usage['calls']} calls, {usage['total_tokens']} tokens "
+                  f"({usage['reasoning_tokens']} reasoning), ~${usage['cost']:.4f}")
             await browser.close()
 
     asyncio.run(run_steps())
@@ -0,0 +1,180 @@
+import fnmatch
+import json
+import os
+from pathlib import Path
+
+
+# ---------------------------------------------
+# DEFAULT PER-APP ROUTING RULES
+#   block_resource_types: Playwright resource types to abort (image, font, media, ...)
+#   block_urls:           glob patterns aborted outright
+#   stub_urls:            glob patterns answered locally with an empty 204
+#   cache_urls:           glob patterns matched against the URL without its query string
+#                         (GET only), served from an in-memory cache after first fetch
+# "*" applies to every app; app entries extend it.
+# ---------------------------------------------
+DEFAULT_RULES = {
+    "*": {
+        "block_resource_types": ["media"],
+        "block_urls": [
+            "*google-analytics.com/*",
+            "*googletagmanager.com/*",
+            "*doubleclick.net/*",
+            "*facebook.net/*",
+            "*hotjar.com/*",
+            "*fullstory.com/*",
+            "*intercom.io/*",
+            "*intercomcdn.com/*",
+        ],
+        "stub_urls": [
+            "*api.segment.io/*",
+            "*cdn.segment.com/*",
+            "*sentry.io/*",
+            "*browser-intake-datadoghq.com/*",
+            "*api.amplitude.com/*",
+            # Statsig event logging only: /v1/initialize serves feature gates the UI depends on
+            "*statsig*/v1/rgstr*",
+            "*statsig*/v1/log_event*",
+        ],
+        "cache_urls": [
+            "*.js", "*.css",
+            "*.woff", "*.woff2", "*.ttf",
+            "*.svg", "*.png", "*.jpg", "*.jpeg", "*.webp", "*.gif",
+        ],
+    },
+    "notion": {
+        "stub_urls": [
+            "*notion.so/api/v3/trackSegmentEvent*",
+            "*notion.so/api/v3/etClient*",
+            "*notion.so/api/v3/logClientError*",
+            "*http-inputs-notion.splunkcloud.com/*",
+        ],
+    },
+    "linear": {
+        "stub_urls": [
+            "*linear.app/api/metrics*",
+            "*client-api.linear.app/event*",
+        ],
+    },
+}
+
+RULE_KEYS = ("block_resource_types", "block_urls", "stub_urls", "cache_urls")
+
+
+def load_rules(app, path=None):
+    """
+    Merges the "*" rules with the rules for `app`. A JSON file with the same
+    structure (path or NETWORK_RULES_FILE) is merged on top of the defaults.
+    """
+    sources = [DEFAULT_RULES]
+    path = path or os.getenv("NETWORK_RULES_FILE")
+    if path:
+        with open(path) as f:
+            sources.append(json.load(f))
+
+    rules = {key: [] for key in RULE_KEYS}
+    for source in sources:
+        for scope in ("*", app):
+            for key in RULE_KEYS:
+                rules[key].extend(source.get(scope, {}).get(key, []))
+    return rules
+
+
+class NetworkRouter:
+    """
+    Applies block / stub / cache rules to every request of a browser context.
+    Unmatched requests fall through (route.fallback) to HAR replay or the network.
+    The asset cache is shared by every context this router is applied to.
+    """
+
+    def __init__(self, rules, max_cache_bytes=200 * 1024 * 1024):
+        self.rules = rules
+        self.block_types = set(rules["block_resource_types"])
+        self.max_cache_bytes = max_cache_bytes
+        self._cache = {}
+        self._cache_bytes = 0
+        self.stats = {"blocked": 0, "stubbed": 0, "cache_hits": 0, "cache_misses": 0, "passed": 0}
+
+    @classmethod
+    def for_app(cls, app):
+        return cls(load_rules(app))
+
+    async def apply(self, context, cache=True):
+        async def handler(route):
+            await self._handle(route, cache)
+        await context.route("**/*", handler)
+
+    def _matches(self, url, patterns):
+        return any(fnmatch.fnmatchcase(url, pattern) for pattern in patterns)
+
+    async def _handle(self, route, cache=True):
+        request = route.request
+        url = request.url
+
+        if request.resource_type in self.block_types or self._matches(url, self.rules["block_urls"]):
+            self.stats["blocked"] += 1
+            await route.abort()
+            return
+
+        if self._matches(url, self.rules["stub_urls"]):
+            self.stats["stubbed"] += 1
+            await route.fulfill(status=204, body="")
+            return
+
+        if cache and request.method == "GET" and self._matches(url.split("?", 1)[0], self.rules["cache_urls"]):
+            cached = self._cache.get(url)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                await route.fulfill(status=cached["status"], headers=cached["headers"], body=cached["body"])
+                return
+            try:
+                response = await route.fetch()
+                body = await response.body()
+            except Exception:
+                # Let Playwright handle it normally (HAR replay or network error reporting)
+                await route.fallback()
+                return
+            self.stats["cache_misses"] += 1
+            if response.ok and self._cache_bytes + len(body) <= self.max_cache_bytes:
+                self._cache[url] = {"status": response.status, "headers": response.headers, "body": body}
+                self._cache_bytes += len(body)
+            await route.fulfill(response=response, body=body)
+            return
+
+        self.stats["passed"] += 1
+        await route.fallback()
+
+    def save_stats(self, run_folder):
+        path = Path(run_folder)
+        path.mkdir(exist_ok=True, parents=True)
+        with open(path / "network_stats.json", "w") as f:
+            json.dump({**self.stats, "cached_urls": len(self._cache), "cached_bytes": self._cache_bytes}, f, indent=2)
+
+
+async def prepare_context(context, network_router=None, mode="live", har_path=None, not_found="abort"):
+    """
+    Sets up request handling for a new context.
+
+    mode:
+      - "live":   rules only, everything else goes to the network
+      - "record": rules + every request that reaches the network is recorded
+                  into `har_path` (written when the context closes)
+      - "replay": rules + responses are served from `har_path`; unmatched
+                  requests are aborted (not_found="abort") or sent to the
+                  network (not_found="fallback")
+
+    The HAR route is registered first so rule handlers (registered last, run
+    first) can still block/stub/cache before a request reaches it. The asset
+    cache is only used live: route.fetch() would bypass HAR replay and its
+    fulfilled responses would not be recorded.
+    """
+    if mode == "record":
+        Path(har_path).parent.mkdir(exist_ok=True, parents=True)
+        await context.route_from_har(har_path, update=True, update_content="embed", update_mode="minimal")
+    elif mode == "replay":
+        if not har_path or not Path(har_path).exists():
+            raise FileNotFoundError(f"HAR file for replay not found: {har_path}")
+        await context.route_from_har(har_path, not_found=not_found)
+
+    if network_router is not None:
+        await network_router.apply(context, cache=mode == "live")
@@ -3,6 +3,9 @@ import asyncio
 from pathlib import Path
 from playwright.async_api import async_playwright
 import hashlib
+from dom_compact import compact_semantic_dom, compact_accessibility_tree, dump_compact
+from cdp_snapshot import CDPSnapshotExtractor
+from network_rules import NetworkRouter
 
 def dom_hash(dom: str):
     """Returns a stable MD5 hash for DOM comparison."""
@@ -25,7 +28,8 @@ class StepExecutor:
     """
 
     def __init__(self, steps, output_dir="agent_outputs",
-                 capture_dom=True, capture_accessibility=True):
+                 capture_dom=True, capture_accessibility=True,
+                 compact_states=False, extractor="evaluate", network_router=None):
 
         self.steps = steps
 
@@ -40,18 +44,315 @@ class StepExecutor:
 
         self.capture_dom = capture_dom
         self.capture_accessibility = capture_accessibility
+        # Write DOM / AX files in the interned compact form (see dom_compact.py)
+        self.compact_states = compact_states
+
+        # "cdp" captures DOM + AX in a single DOMSnapshot/getFullAXTree pass (Chromium only)
+        self.extractor = extractor
+        self.cdp_extractor = CDPSnapshotExtractor() if extractor == "cdp" else None
+        self.last_snapshot_stats = None
+
+        # Block/stub/cache rules applied to the context created by run()
+        self.network_router = network_router
 
     # ---------------------------------------------
     # SEMANTIC DOM TREE FOR AGENTIC NEXT-STEP PLANNING
     # ---------------------------------------------
     async def _extract_semantic_dom(self, page):
+        # Every selector is checked unique inside this single evaluate call,
+        # against match counts built in linear passes over the page (the same
+        # scheme as cdp_snapshot._SelectorIndex). Candidates are tried from
+        # most to least stable; the scores match SELECTOR_STABILITY there.
         return await page.evaluate(
             """() => {
                 const nodes = document.querySelectorAll(
                     'button, a, input, textarea, select, [role], [contenteditable]'
                 );
+                // Every element of the page, in document order; all counts below are
+                // computed over it in O(n) passes instead of one query per candidate
+                const all = [...document.getElementsByTagName('*')];
+                const index = new Map(all.map((el, i) => [el, i]));
+                const parentIdx = all.map(el => el.parentElement ? index.get(el.parentElement) : -1);
+
+                const TEST_ATTRS = ['data-testid', 'data-test-id', 'data-test', 'data-qa', 'data-cy'];
+                const SELECTOR_ATTRS = new Set([...TEST_ATTRS, 'id', 'name', 'aria-label', 'placeholder', 'href']);
+                const INTERACTIVE_TAGS = new Set(['button', 'a', 'input', 'textarea', 'select']);
+                // Playwright's elementText() (used by :text-is) leaves these subtrees out
+                const TEXT_SKIPPED_TAGS = new Set(['script', 'noscript', 'style', 'head']);
+                const MAX_TEXT = 50;
+                const MAX_NAME = 1000;
+                // Elements the role= engine matches by implicit role that the query
+                // above does not select
+                const IMPLICIT_ROLE_SELECTORS = {
+                    heading: 'h1, h2, h3, h4, h5, h6', listitem: 'li', list: 'ul, ol, menu',
+                    option: 'option', navigation: 'nav', img: 'img', row: 'tr', cell: 'td',
+                    gridcell: 'td', columnheader: 'th', rowheader: 'th', table: 'table',
+                    dialog: 'dialog', article: 'article', region: 'section', main: 'main',
+                    banner: 'header', contentinfo: 'footer', complementary: 'aside', form: 'form',
+                    group: 'fieldset, details, optgroup', link: 'area[href]', button: 'summary',
+                    listbox: 'datalist', paragraph: 'p', separator: 'hr', figure: 'figure',
+                    progressbar: 'progress', meter: 'meter', term: 'dfn, dt', definition: 'dd',
+                };
+
+                const norm = (s) => (s || '').replace(/\\s+/g, ' ').trim();
+                // Playwright's normalizeWhiteSpace()
+                const normText = (s) => s.replace(/\\u200b/g, '').trim().replace(/\\s+/g, ' ');
+                const cssString = (s) => '"' + s.replace(/["\\\\]/g, '\\\\$&').replace(/\\n/g, ' ') + '"';
+
+                // CSS-in-JS classes, React useId ids, build hashes ...
+                const looksGenerated = (s) =>
+                    /\\d{3,}/.test(s) || s.startsWith(':') ||
+                    s.split(/[-_]/).some(p => p.length >= 5 && /\\d/.test(p) && /[a-z]/i.test(p));
+
+                // Attribute / class match counts: "tag\\nattr\\nvalue" and "\\nattr\\nvalue" (any tag)
+                const attrCounts = new Map();
+                const bump = (key) => attrCounts.set(key, (attrCounts.get(key) || 0) + 1);
+                for (const el of all) {
+                    const tag = el.tagName.toLowerCase();
+                    for (const { name, value } of el.attributes) {
+                        if (!value || !SELECTOR_ATTRS.has(name)) continue;
+                        bump(`${tag}\\n${name}\\n${value}`);
+                        bump(`\\n${name}\\n${value}`);
+                    }
+                    for (const cls of el.classList) bump(`${tag}\\n.\\n${cls}`);
+                }
+                const attrCount = (tag, attr, value) => attrCounts.get(`${tag}\\n${attr}\\n${value}`) || 0;
+
+                // Whitespace-collapsed text keeping one space for leading/trailing
+                // whitespace, so joined pieces collapse like the concatenated text would.
+                // null once longer than the cap (joining only makes it longer).
+                const piece = (s) => {
+                    s = s.replace(/\\u200b/g, '');
+                    const core = s.replace(/\\s+/g, ' ').trim();
+                    if (!core) return s ? ' ' : '';
+                    return (/^\\s/.test(s) ? ' ' : '') + core + (/\\s$/.test(s) ? ' ' : '');
+                };
+                const join = (a, b) => a === null || b === null ? null
+                    : a.endsWith(' ') && b.startsWith(' ') ? a + b.slice(1) : a + b;
+                const cap = (p, max) => p !== null && p.trim().length > max ? null : p;
+
+                // One bottom-up pass: texts[i] is element i's text as :text-is() sees it
+                // (descendant text concatenated, shadow root last), names[i] that text
+                // plus img alt, as raw material for the role name counts
+                const texts = new Array(all.length);
+                const names = new Array(all.length);
+                for (let i = all.length - 1; i >= 0; i--) {
+                    const el = all[i];
+                    const tag = el.tagName.toLowerCase();
+                    if (TEXT_SKIPPED_TAGS.has(tag)) {
+                        texts[i] = names[i] = '';
+                        continue;
+                    }
+                    if (tag === 'input' && (el.type === 'submit' || el.type === 'button')) {
+                        texts[i] = names[i] = piece(el.value);
+                        continue;
+                    }
+                    let text = '';
+                    let name = tag === 'img' ? piece(el.getAttribute('alt') || '') : '';
+                    for (const child of el.childNodes) {
+                        if (child.nodeType === Node.TEXT_NODE) {
+                            const p = piece(child.nodeValue || '');
+                            text = join(text, p);
+                            name = join(name, p);
+                        } else if (child.nodeType === Node.ELEMENT_NODE) {
+                            const j = index.get(child);
+                            text = join(text, texts[j]);
+                            name = join(name, names[j]);
+                        }
+                    }
+                    if (el.shadowRoot) {
+                        const p = piece(el.shadowRoot.textContent || '');
+                        text = join(text, p);
+                        name = join(name, p);
+                    }
+                    texts[i] = cap(text, MAX_TEXT);
+                    names[i] = cap(name, MAX_NAME);
+                }
+                // :text-is() also matches an element one of whose own runs of text equals it
+                const ownRuns = (el) => {
+                    const runs = [];
+                    let run = '';
+                    for (const child of el.childNodes) {
+                        if (child.nodeType === Node.TEXT_NODE) run += child.nodeValue || '';
+                        else if (child.nodeType !== Node.COMMENT_NODE) { runs.push(run); run = ''; }
+                    }
+                    runs.push(run);
+                    return runs.map(normText).filter(r => r && r.length <= MAX_TEXT);
+                };
+
+                const implicitRole = (el) => {
+                    const tag = el.tagName.toLowerCase();
+                    const type = (el.getAttribute('type') || 'text').toLowerCase();
+                    if (tag === 'button') return 'button';
+                    if (tag === 'a') return el.hasAttribute('href') ? 'link' : null;
+                    if (tag === 'textarea') return 'textbox';
+                    if (tag === 'select') return el.multiple || el.size > 1 ? 'listbox' : 'combobox';
+                    if (tag !== 'input') return null;
+                    if (['button', 'submit', 'reset', 'image'].includes(type)) return 'button';
+                    if (type === 'checkbox' || type === 'radio') return type;
+                    if (type === 'range') return 'slider';
+                    if (type === 'number') return 'spinbutton';
+                    if (type === 'search') return 'searchbox';
+                    return type === 'hidden' ? null : 'textbox';
+                };
+                const roleOf = (el) => (el.getAttribute('role') || '').split(' ')[0] || implicitRole(el);
+
+                const labelledByText = (el) => norm((el.getAttribute('aria-labelledby') || '')
+                    .split(/\\s+/).filter(Boolean).map(id => (document.getElementById(id) || {}).textContent || '').join(' '));
+
+                // Only names from explicit labels are used in role selectors: a
+                // content-derived name (textContent) can include aria-hidden hints and
+                // miss img alt text, so it need not equal the name Playwright computes
+                const explicitName = (el) => {
+                    const labelledby = labelledByText(el);
+                    if (labelledby) return labelledby;
+                    const aria = norm(el.getAttribute('aria-label'));
+                    if (aria) return aria;
+                    return el.labels && el.labels.length ? norm(el.labels[0].textContent) : '';
+                };
+                // Everything Playwright's computed name could be built from, so the
+                // uniqueness count below errs on the side of "not unique"; null (a
+                // very long text) may contain any name
+                const nameSources = (el) => {
+                    const content = names[index.get(el)];
+                    if (content === null) return null;
+                    return norm([
+                        el.getAttribute('aria-label'), labelledByText(el),
+                        ...(el.labels ? [...el.labels].map(l => l.textContent) : []),
+                        content, el.getAttribute('title'), el.getAttribute('placeholder'), el.value,
+                    ].filter(s => typeof s === 'string').join(' ')).toLowerCase();
+                };
+
+                // Selector every element of the node's kind matches; all of them are
+                // in `nodes`, so text counts only need to look at `nodes`
+                const baseSelector = (el) => {
+                    const tag = el.tagName.toLowerCase();
+                    if (INTERACTIVE_TAGS.has(tag)) return tag;
+                    if (el.hasAttribute('role')) return `${tag}[role=${cssString(el.getAttribute('role'))}]`;
+                    return `${tag}[contenteditable]`;
+                };
+
+                const infos = [...nodes].map(el => {
+                    const role = roleOf(el);
+                    const text = texts[index.get(el)];
+                    return {
+                        el, role,
+                        name: role ? explicitName(el) : '',
+                        base: baseSelector(el),
+                        fullText: text === null ? '' : text.trim(),
+                    };
+                });
+
+                // role=...[name=...] is a case-insensitive substring match, so
+                // count every element of that role whose possible name contains this one
+                const roleNames = new Map();
+                const roleCount = (role, name) => {
+                    if (!roleNames.has(role)) {
+                        const list = infos.filter(info => info.role === role).map(info => nameSources(info.el));
+                        if (IMPLICIT_ROLE_SELECTORS[role]) {
+                            for (const el of document.querySelectorAll(IMPLICIT_ROLE_SELECTORS[role])) {
+                                if (!el.hasAttribute('role')) list.push(nameSources(el));
+                            }
+                        }
+                        roleNames.set(role, list);
+                    }
+                    const needle = name.toLowerCase();
+                    return roleNames.get(role).filter(n => n === null || n.includes(needle)).length;
+                };
+
+                const textCounts = new Map();
+                for (const { el, base, fullText } of infos) {
+                    const tag = el.tagName.toLowerCase();
+                    const matched = TEXT_SKIPPED_TAGS.has(tag) ? [] : ownRuns(el);
+                    for (const text of new Set([fullText, ...matched])) {
+                        if (!text) continue;
+                        const key = `${base}\\n${text}`;
+                        textCounts.set(key, (textCounts.get(key) || 0) + 1);
+                    }
+                }
+                const textCount = (base, text) => textCounts.get(`${base}\\n${text}`) || 0;
+
+                // nth-of-type of every element and how many siblings share its tag
+                const nth = new Array(all.length);
+                const sameTag = new Map();
+                for (let i = 0; i < all.length; i++) {
+                    const key = `${parentIdx[i]}\\n${all[i].tagName}`;
+                    nth[i] = (sameTag.get(key) || 0) + 1;
+                    sameTag.set(key, nth[i]);
+                }
+                // nth is dropped for an only child of its tag unless `exact`: a bare
+                // tag also matches elements that have siblings
+                const segment = (i, exact) => {
+                    const tag = all[i].tagName.toLowerCase();
+                    return exact || sameTag.get(`${parentIdx[i]}\\n${all[i].tagName}`) > 1
+                        ? `${tag}:nth-of-type(${nth[i]})` : tag;
+                };
+                const anchorOf = (el) => {
+                    for (const attr of TEST_ATTRS) {
+                        const v = el.getAttribute(attr);
+                        if (v && attrCount('', attr, v) === 1) return `[${attr}=${cssString(v)}]`;
+                    }
+                    if (el.id && !looksGenerated(el.id) && attrCount('', 'id', el.id) === 1) {
+                        return `#${CSS.escape(el.id)}`;
+                    }
+                    return null;
+                };
+
+                // levels[k]: id of every element's exact path suffix of length k + 1
+                // (itself and its k nearest ancestors) and the count of each id. Each
+                // level is built from the one below in O(n), only when first needed.
+                const levels = [];
+                const pathLevel = (length) => {
+                    while (levels.length < length) {
+                        const below = levels.length ? levels[levels.length - 1].keys : null;
+                        const ids = new Map();
+                        const keys = new Array(all.length);
+                        const counts = [];
+                        for (let i = 0; i < all.length; i++) {
+                            let key = segment(i, true);
+                            if (below) {
+                                const p = parentIdx[i];
+                                if (p < 0 || below[p] === undefined) continue;
+                                key += `\\n${below[p]}`;
+                            }
+                            let id = ids.get(key);
+                            if (id === undefined) {
+                                id = ids.size;
+                                ids.set(key, id);
+                                counts.push(0);
+                            }
+                            keys[i] = id;
+                            counts[id] += 1;
+                        }
+                        levels.push({ keys, counts });
+                    }
+                    return levels[length - 1];
+                };
+
+                // Shortest child-combinator path that is unique, stopping early at an
+                // ancestor with a stable test id / id (the path below it is unique by
+                // construction)
+                const ancestorPath = (el) => {
+                    const i = index.get(el);
+                    const chain = [i];
+                    while (true) {
+                        const { keys, counts } = pathLevel(chain.length);
+                        if (counts[keys[i]] === 1) {
+                            const path = chain.map(j => segment(j, true)).reverse().join(' > ');
+                            return [path, +Math.max(0.3 - 0.02 * (chain.length - 1), 0.1).toFixed(2)];
+                        }
+                        const cur = parentIdx[chain[chain.length - 1]];
+                        if (cur < 0) return [null, 0];
+                        const anchor = anchorOf(all[cur]);
+                        if (anchor) {
+                            const path = [anchor, ...chain.map(j => segment(j, false)).reverse()].join(' > ');
+                            return [path, +Math.max(0.5 - 0.05 * chain.length, 0.2).toFixed(2)];
+                        }
+                        chain.push(cur);
+                    }
+                };
 
-                const describe = (el) => {
+                const describe = ({ el, role: axRole, name, base, fullText: shortText }) => {
                     const tag = el.tagName.toLowerCase();
                     const text = (el.innerText || '').trim().slice(0, 200);
                     const aria = el.getAttribute('aria-label');
@@ -60,27 +361,52 @@ class StepExecutor:
                     const href = el.getAttribute('href');
                     const type = el.getAttribute('type');
                     const id = el.id;
-                    const dt = el.getAttribute('data-testid');
-                    const name = el.getAttribute('name');
+                    const elName = el.getAttribute('name');
+                    const classes = [...el.classList].filter(c => !looksGenerated(c));
+                    const unique = (attr, value) => attrCount(tag, attr, value) === 1;
+
+                    // [stability, () => selector matching only el, or null], most stable first
+                    const candidates = [
+                        ...TEST_ATTRS.map(attr => [1.0, () => {
+                            const v = el.getAttribute(attr);
+                            return v && unique(attr, v) ? `${tag}[${attr}=${cssString(v)}]` : null;
+                        }]),
+                        [0.9, () => id && !looksGenerated(id) && unique('id', id) ? `${tag}#${CSS.escape(id)}` : null],
+                        [0.85, () => elName && unique('name', elName) ? `${tag}[name=${cssString(elName)}]` : null],
+                        [0.85, () => aria && unique('aria-label', aria) ? `${tag}[aria-label=${cssString(aria)}]` : null],
+                        [0.8, () => axRole && name && name.length <= 80 && roleCount(axRole, name) === 1
+                            ? `role=${axRole}[name=${JSON.stringify(name)}]` : null],
+                        [0.75, () => placeholder && unique('placeholder', placeholder)
+                            ? `${tag}[placeholder=${cssString(placeholder)}]` : null],
+                        [0.65, () => shortText && textCount(base, shortText) === 1
+                            ? `${base}:text-is(${JSON.stringify(shortText)})` : null],
+                        [0.6, () => href && !href.startsWith('javascript:') && href.length <= 120 && unique('href', href)
+                            ? `${tag}[href=${cssString(href)}]` : null],
+                        [0.45, () => {
+                            const cls = classes.find(c => unique('.', c));
+                            return cls ? `${tag}.${CSS.escape(cls)}` : null;
+                        }],
+                    ];
 
                     let selector = null;
-
-                    if (dt) selector = `${tag}[data-testid="${dt}"]`;
-                    else if (id) selector = `${tag}#${id}`;
-                    else if (name) selector = `${tag}[name="${name}"]`;
-                    else if (aria) selector = `${tag}[aria-label="${aria}"]`;
-                    else {
-                        const cl = [...el.classList].slice(0, 2).join('.');
-                        selector = cl ? `${tag}.${cl}` : tag;
+                    let stability = 0;
+                    for (const [score, build] of candidates) {
+                        const sel = build();
+                        if (sel) {
+                            selector = sel;
+                            stability = score;
+                            break;
+                        }
                     }
+                    if (!selector) [selector, stability] = ancestorPath(el);
 
                     return {
                         tag, text, aria, role, placeholder, href, type,
-                        selector
+                        selector, stability
                     };
                 };
 
-                return [...nodes].map(describe);
+                return infos.map(describe);
             }"""
         )
 
@@ -93,22 +419,59 @@ class StepExecutor:
         except:
             return None
 
+    # ---------------------------------------------
+    # COMBINED UI STATE (Semantic DOM + AX Tree)
+    # ---------------------------------------------
+    async def _extract_ui_state(self, page):
+        """
+        Returns (semantic_dom, accessibility_tree) for the current page.
+        Uses the single-pass CDP extractor when enabled and falls back to
+        page.evaluate + page.accessibility.snapshot() if CDP is unavailable.
+        """
+        if self.cdp_extractor is not None:
+            try:
+                semantic_dom, accessibility_tree, stats = await self.cdp_extractor.capture(page)
+                self.last_snapshot_stats = stats
+                with open(self.output_dir / "snapshot_stats.jsonl", "a") as f:
+                    f.write(json.dumps({"url": page.url, **stats}) + "\n")
+                return semantic_dom, accessibility_tree
+            except Exception as e:
+                print(f"[WARN] CDP snapshot failed, falling back to page.evaluate: {e}")
+
+        semantic_dom = await self._extract_semantic_dom(page)
+        accessibility_tree = await self._extract_accessibility_tree(page)
+        return semantic_dom, accessibility_tree
+
     # ---------------------------------------------
     # SAVE STATE (Screenshot + DOM + AX Tree)
     # ---------------------------------------------
     async def _save_state(self, page, idx, description):
+        """
+        Saves screenshot + DOM + AX files and returns the captured
+        (semantic_dom, accessibility_tree) so callers don't extract twice.
+        """
         screenshot_path = self.screenshots_dir / f"{idx+1}_{description}.png"
         await page.screenshot(path=screenshot_path)
 
+        dom_data, acc = await self._extract_ui_state(page)
+
         if self.capture_dom:
-            dom_data = await self._extract_semantic_dom(page)
-            with open(self.dom_dir / f"{idx+1}_{description}_dom.json", "w") as f:
-                json.dump(dom_data, f, indent=2)
+            dom_path = self.dom_dir / f"{idx+1}_{description}_dom.json"
+            if self.compact_states:
+                dump_compact(compact_semantic_dom(dom_data), dom_path)
+            else:
+                with open(dom_path, "w") as f:
+                    json.dump(dom_data, f, indent=2)
 
         if self.capture_accessibility:
-            acc = await self._extract_accessibility_tree(page)
-            with open(self.dom_dir / f"{idx+1}_{description}_accessibility.json", "w") as f:
-                json.dump(acc, f, indent=2)
+            acc_path = self.dom_dir / f"{idx+1}_{description}_accessibility.json"
+            if self.compact_states:
+                dump_compact(compact_accessibility_tree(acc), acc_path)
+            else:
+                with open(acc_path, "w") as f:
+                    json.dump(acc, f, indent=2)
+
+        return dom_data, acc
 
         # ---------------------------------------------
         # SAFE HELPERS
@@ -283,8 +646,8 @@ class StepExecutor:
                 await frame.fill(selector, value)
 
             elif action == "screenshot":
-                await self._save_state(page, idx, desc)
-                return True, None, await self._extract_semantic_dom(page), await self._extract_accessibility_tree(page)
+                semantic_dom, accessibility_tree = await self._save_state(page, idx, desc)
+                return True, None, semantic_dom, accessibility_tree
 
             else:
                 raise Exception(f"Unknown action: {action}")
@@ -315,10 +678,7 @@ class StepExecutor:
 
             # ---------------- Store State ----------------
 
-            await self._save_state(page, idx, desc)
-
-            semantic_dom = await self._extract_semantic_dom(page)
-            accessibility_tree = await self._extract_accessibility_tree(page)
+            semantic_dom, accessibility_tree = await self._save_state(page, idx, desc)
 
             return True, None, semantic_dom, accessibility_tree
 
@@ -326,8 +686,7 @@ class StepExecutor:
             error_msg = str(e)
             print(f"❌ Error in single step {idx+1}: {error_msg}")
 
-            semantic_dom = await self._extract_semantic_dom(page)
-            accessibility_tree = await self._extract_accessibility_tree(page)
+            semantic_dom, accessibility_tree = await self._extract_ui_state(page)
 
             return False, error_msg, semantic_dom, accessibility_tree
 
@@ -340,6 +699,8 @@ class StepExecutor:
         async with async_playwright() as p:
             browser = await p.chromium.launch(headless=False)
             context = await browser.new_context(storage_state="notion_state.json")
+            if self.network_router is not None:
+                await self.network_router.apply(context)
             page = await context.new_page()
 
             for idx, step in enumerate(self.steps):
@@ -521,7 +882,8 @@ if __name__ == "__main__":
         steps=sample_steps,
         output_dir="agent_test_output",
         capture_dom=True,
-        capture_accessibility=True
+        capture_accessibility=True,
+        network_router=NetworkRouter.for_app("notion")
     )
 
     # Explicitly create the screenshots folder